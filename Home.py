@@ -2,14 +2,148 @@
 
 import json
 import os
+from typing import Optional
 
 import pandas as pd
 import streamlit as st
 
 import hotmodel.stats as stats
-from hotmodel import hotplot
+from hotmodel import hotplot, profiling
+from hotmodel.abtest import compare_variants
+from hotmodel.arrow_frame import ArrowFrame
+from hotmodel.compact import compact, memory_report
 from hotmodel.data_loader import DatasetLoader
 from hotmodel.model import HotModelClassifier
+from hotmodel.uplift import UpliftRecommender
+
+# Every expensive stage below is cached across reruns, keyed on the `version` of the data it
+# gets (built from the source file, the schema and the transformation steps) and on its
+# parameters. Arguments starting with `_` are not hashed by Streamlit.
+
+# fmt: off
+FEATURES = [
+    "c1", "c2", "c3", "c4", "c6",
+    "n1", "n2", "n3", "n4", "n5", "n6", "n7", "n8", "n10", "n11", "n12", "n14",
+]
+# fmt: on
+ORDINAL_FEATURES = ["c1", "c2", "c3", "c4", "c6"]
+# features known before the experiment, for the uplift recommender
+# fmt: off
+UPLIFT_FEATURES = ORDINAL_FEATURES + [
+    "n1", "n2", "n3", "n4", "n5", "n6", "n7", "n8", "n10", "n11", "n12",
+]
+# fmt: on
+# columns of the significance tests and the engagement plots
+ENGAGEMENT_COLUMNS = ["variant", "c1", "c2", "c3", "c4", "c6", "n1", "n13", "n14"]
+
+
+@st.cache_resource(show_spinner="Loading the dataset...")
+def load_dataset(
+    path: str, cache_dir: Optional[str], version: str, schema: dict[str, list[str]], backend: str
+) -> DatasetLoader:
+    # the versions derived from this loader with `then` share its cache of intermediate results
+    dataloader = DatasetLoader(path=path, cache_dir=cache_dir, backend=backend)
+    dataloader.load_data(**schema)
+    return dataloader
+
+
+@st.cache_data
+def stats_by_variant(_data: pd.DataFrame, version: str, col: list[str]) -> pd.DataFrame:
+    return stats.get_stats_by_variant(_data, col=col)
+
+
+@st.cache_data
+def compact_memory_report(_data: pd.DataFrame, version: str) -> pd.DataFrame:
+    return memory_report(_data, compact(_data))
+
+
+@st.cache_data
+def missing_values(_data: pd.DataFrame, version: str) -> pd.DataFrame:
+    return stats.get_percentage_missing_values(_data)
+
+
+@st.cache_data
+def categorical_substats(_data: pd.DataFrame, version: str, col: list[str]) -> dict:
+    return stats.get_categorical_substats_by_variant_and_column(data=_data, col=col)
+
+
+@st.cache_data
+def count_by_variant(_data: pd.DataFrame, version: str) -> pd.DataFrame:
+    return stats.get_non_missing_counts_by_variant(_data)
+
+
+def preview(data: pd.DataFrame, n_rows: int = 10_000) -> pd.DataFrame:
+    # out-of-core frames are only shown in part
+    return data.head(n_rows) if isinstance(data, ArrowFrame) else data
+
+
+@st.cache_data(show_spinner="Running the significance tests...")
+def variant_comparison(_data: pd.DataFrame, version: str) -> pd.DataFrame:
+    return compare_variants(
+        _data, metrics=["n13", "n14"], segments=["c1", "c2", "c3", "c4", "c6"], covariate="n1"
+    )
+
+
+@st.cache_resource(show_spinner="Training the model...")
+def train_model(
+    _data: pd.DataFrame, version: str, hyperparameters: dict, model_path: Optional[str]
+) -> HotModelClassifier:
+    model = HotModelClassifier(data=_data, features=FEATURES, hyperparameters=hyperparameters)
+    # optional: fitted models are saved in this directory and reloaded while data and
+    # hyperparameters stay the same
+    if model_path is not None:
+        model.fit_or_load(
+            model_path, ordinal_features=ORDINAL_FEATURES, one_hot_features=None, target="variant"
+        )
+    else:
+        df_transformed = model.pipeline_builder(
+            ordinal_features=ORDINAL_FEATURES, one_hot_features=None
+        )
+        model.train(df_transformed, target="variant")
+    return model
+
+
+@st.cache_resource(show_spinner="Training the uplift recommender...")
+def train_uplift_recommender(
+    _data: pd.DataFrame, version: str, model_path: Optional[str]
+) -> UpliftRecommender:
+    recommender = UpliftRecommender(features=UPLIFT_FEATURES, ordinal_features=ORDINAL_FEATURES)
+    # saved next to the classifier, and reloaded while the data stays the same
+    if model_path is not None:
+        return recommender.fit_or_load(_data, model_path)
+    return recommender.fit(_data)
+
+
+@st.cache_data(show_spinner="Bootstrapping the evaluation metrics...")
+def evaluation_metrics(_model: HotModelClassifier, version: str, hyperparameters: dict):
+    return _model.compute_evaluation_metric(n_bootstrap=1000, confidence=0.95)
+
+
+def profile_sidebar(profile: profiling.Profile):
+    summary = profile.summary()
+    summary["peak_memory_delta"] = summary["peak_memory_delta"] / 2**20
+    st.sidebar.subheader("Stage profile")
+    st.sidebar.caption(
+        f"""{len(profile.records)} stages ran in this run, cached ones are skipped. Times are in
+        seconds, peak memory (when traced) above the memory in use when the stage started in
+        MiB."""
+    )
+    st.sidebar.dataframe(
+        summary.rename(columns={"peak_memory_delta": "peak_memory_mib"}),
+        column_config={
+            c: st.column_config.NumberColumn(format="%.3f")
+            for c in ["wall_time", "cpu_time", "peak_memory_mib"]
+        },
+    )
+
+
+# optional: time and memory of every stage of this run in the sidebar, also appended as JSON
+# lines to the file `profiling_log` when it is set
+profile = None
+if st.sidebar.toggle("Profile the stages of this run", key="profiling"):
+    # tracing allocations slows down allocation-heavy stages such as plotting severalfold
+    trace_memory = st.sidebar.toggle("Trace memory (slower)", key="profiling_memory")
+    profile = profiling.start(trace_memory=trace_memory, log_path=os.environ.get("profiling_log"))
 
 st.title("Data Analysis")
 
@@ -64,10 +198,27 @@ if path is None:
     st.exception(EnvironmentError("Environment Variable `data_path` is not set."))
     st.stop()
 
-dataloader = DatasetLoader(path=path)
-
-dataloader.load_data()
-st.write(dataloader.data)
+categorical_features = ["c1", "c2", "c3", "c4", "c6", "variant"]
+boolean_features = ["c5"]
+# fmt: off
+numerical_features = [
+    "n1", "n2", "n3", "n4", "n5", "n6", "n7", "n8", "n9", "n10", "n11", "n12", "n13", "n14"
+]
+# fmt: on
+schema = {
+    "categorical_columns": categorical_features,
+    "numerical_columns": numerical_features,
+    "boolean_columns": boolean_features,
+}
+
+# optional: parsed datasets are cached as columnar files in this directory between reruns
+cache_dir = os.environ.get("cache_path")
+# optional: "arrow" keeps the data in a Parquet dataset in `cache_path` instead of in memory
+backend = os.environ.get("backend", "pandas")
+version = DatasetLoader(path=path).fingerprint(DatasetLoader.build_dtypes(**schema))
+dataloader = load_dataset(path, cache_dir, version, schema, backend)
+# every transformation below is a lazy step on top of this loader, see `DatasetLoader.then`
+st.write(preview(dataloader.data))
 
 st.write(
     """
@@ -83,33 +234,37 @@ dataloader.data.dtypes
 st.header("3. Parsing data types")
 st.write(
     """
-    As it is possible to observe, most categorical features were loaded as `object`. This is really
-    bad since matricial operations on objects are known to lazely evaluated, and if you have a large
-    dataset (that fits in memory) the operations will take longer processing time. We should coerce
-    its type to `string`.
+    Left to its own devices, `pandas.read_csv` loads most categorical features as `object`. This is
+    really bad since matricial operations on objects are known to lazely evaluated, and if you have
+    a large dataset (that fits in memory) the operations will take longer processing time.
 
-    Lastly, Let's remove the column `id`, since it is just a mapping of earch row. It really
-    doesn`t bring any real information regarding the user.
+    That is why the data above was loaded with its schema given up front: categorical features are
+    parsed straight to `category`, numerical features to `float` and `c5` to `boolean`, so there is
+    no second pass coercing the types after loading.
 
-    Let`s verify the data type after coercion:
+    The column `id` is not even read, since it is just a mapping of earch row. It really
+    doesn`t bring any real information regarding the user.
     """
 )
 
-categorical_features = ["c1", "c2", "c3", "c4", "c6", "variant"]
-boolean_features = features = ["c5"]
-# fmt: off
-numerical_features = [
-    "n1", "n2", "n3", "n4", "n5", "n6", "n7", "n8", "n9", "n10", "n11", "n12", "n13", "n14"
-]
-# fmt: on
-
-dataloader.parse_column_types(
-    categorical_columns=categorical_features,
-    numerical_columns=numerical_features,
-    boolean_columns=boolean_features,
+st.write(
+    """
+    Categorical features parsed as `category` are stored as small integer codes plus a single
+    copy of each distinct value. The numerical features can be made smaller too: `float32` keeps
+    about 7 significant digits and a range up to 3e38, which is plenty even for `n6` and `n10`.
+    Loading with `load_data(..., compact=True)` downcasts every column as far as its values
+    allow within a relative tolerance, as reported bellow:
+    """
 )
-
-dataloader.data.dtypes
+if isinstance(dataloader.data, ArrowFrame):
+    st.info(
+        """
+        With the `arrow` backend the data stays in a Parquet dataset on disk and only the batches
+        being aggregated are held in memory, so there is no in-memory representation to compact.
+        """
+    )
+else:
+    st.write(compact_memory_report(dataloader.data, dataloader.version))
 
 
 st.header("4. Features with missing values")
@@ -120,7 +275,7 @@ st.write(
     a `boolean` value. Let's  verify some statistics regarding this feature for each test variant:
     """
 )
-st.write(stats.get_stats_by_variant(dataloader.data, col=["c5"]))
+st.write(stats_by_variant(dataloader.data, dataloader.version, col=["c5"]))
 
 st.write(
     """
@@ -135,7 +290,7 @@ st.write(
     """
 )
 
-miss = stats.get_percentage_missing_values(dataloader.data)
+miss = missing_values(dataloader.data, dataloader.version)
 
 st.write(miss)
 
@@ -152,8 +307,8 @@ st.write(
 )
 
 st.write("---")
-cat_stats = stats.get_categorical_substats_by_variant_and_column(
-    data=dataloader.data, col=["c1", "c2", "c3", "c4", "c6"]
+cat_stats = categorical_substats(
+    dataloader.data, dataloader.version, col=["c1", "c2", "c3", "c4", "c6"]
 )
 
 c1, c2, c3 = st.columns(3)
@@ -207,25 +362,22 @@ st.warning(
 )
 
 
-dataloader.data = dataloader.data.drop(["c5", "n9"], axis=1)
+dataloader = dataloader.then("drop", columns=["c5", "n9"])
 
 st.write(
     """This is the dataset distribution for each column considering both variants before the
     undersample of variant A."""
 )
-st.write(dataloader.data.groupby("variant").count())
+st.write(count_by_variant(dataloader.data, dataloader.version))
 
-temp = stats.undersample_col_with_na_with_categorical_group(
-    data=dataloader.data, col="variant", group="A"
-)
+dataloader = dataloader.then("undersample_na", col="variant", group="A")
 
 st.write(
     """This is the dataset distribution for each column considering both variants after the
     undersample of variant A:"""
 )
-dataloader.data = temp
 
-st.write(dataloader.data.groupby("variant").count())
+st.write(count_by_variant(dataloader.data, dataloader.version))
 
 st.write(
     """
@@ -274,11 +426,10 @@ st.write(
 
 min_bound = 0.05
 max_bound = 0.95
-dataloader.data = stats.multi_col_clip(
-    data=dataloader.data,
-    cols=dataloader.numerical_feature_names,
-    quantile_lower_bound=min_bound,
-    quantile_upper_bound=max_bound,
+# the uplift recommender maximizes the revenue, so it learns from the outcomes before clipping
+unclipped = dataloader
+dataloader = dataloader.then(
+    "clip", cols=dataloader.numerical_feature_names, lower=min_bound, upper=max_bound
 )
 
 
@@ -298,7 +449,7 @@ st.write(
     they were already clipped as expected. See below:
     """
 )
-st.write(dataloader.data[["n7", "n10"]])
+st.write(preview(dataloader.data[["n7", "n10"]]))
 
 st.write(
     """
@@ -328,7 +479,9 @@ st.write(
     """
 )
 
-st.write(dataloader.data[["variant", "n1", "n13", "n14"]])
+# the plots and tests of this section need the rows themselves, only of these columns
+engagement_data = dataloader.then("materialize", columns=ENGAGEMENT_COLUMNS)
+st.write(engagement_data.data[["variant", "n1", "n13", "n14"]])
 
 st.write(
     """
@@ -370,7 +523,7 @@ st.markdown(
 )
 
 hotplot.engagement_vs_revenue_multiplot(
-    dataloader=dataloader, group="variant", engagement="n13", revenue="n14"
+    dataloader=engagement_data, group="variant", engagement="n13", revenue="n14"
 )
 
 st.markdown(
@@ -406,6 +559,28 @@ st.write(
     """
 )
 
+st.write(
+    """
+    The error bars can be backed by significance tests. The table bellow compares variant *B*
+    against *A* on both metrics, overall and for every segment of `c1` to `c6`: the difference in
+    means with its bootstrap confidence interval, the Welch t-test and the Mann-Whitney U test.
+
+    The `cuped_*` columns use `n1` only as a pre-experiment covariate (CUPED): the estimated
+    difference stays the same on average, it just gets a narrower confidence interval because
+    the part of the variance that is explained by the users past engagement is removed.
+    """
+)
+
+
+@hotplot.fragment
+def significance_section(data: pd.DataFrame, version: str):
+    # computed on demand: toggling it only reruns this fragment
+    if st.toggle("Run the significance tests", key="significance"):
+        st.write(variant_comparison(data, version))
+
+
+significance_section(engagement_data.data, engagement_data.version)
+
 st.success(
     """
     After analyzing the performance of Variant A and Variant B by just looking at the user
@@ -430,41 +605,16 @@ st.write(
 )
 
 
-dataloader.data.loc[dataloader.data[dataloader.data["c2"].isna()].index, "c2"] = "missing"
-
 hyperparameters_path = os.environ.get("hyperparameters_path")
 with open(hyperparameters_path) as file:
     hyperparameters = json.load(file)
 
-model = HotModelClassifier(
-    data=dataloader.data,
-    features=[
-        "c1",
-        "c2",
-        "c3",
-        "c4",
-        "c6",
-        "n1",
-        "n2",
-        "n3",
-        "n4",
-        "n5",
-        "n6",
-        "n7",
-        "n8",
-        "n10",
-        "n11",
-        "n12",
-        "n14",
-    ],
-    hyperparameters=hyperparameters
-)
-
-df_transformed = model.pipeline_builder(
-    ordinal_features=["c1", "c2", "c3", "c4", "c6"], one_hot_features=None
-)
-
-model.train(df_transformed, target="variant")
+model_data = dataloader.then("materialize", columns=FEATURES + ["variant"]).then(
+    "fill_category", col="c2", value="missing"
+)
+model = train_model(
+    model_data.data, model_data.version, hyperparameters, os.environ.get("model_path")
+)
 
 st.write(
     f"""
@@ -477,6 +627,21 @@ st.write(
     model.model.oob_score_
 )
 
+
+@hotplot.fragment
+def evaluation_section(model: HotModelClassifier, version: str, hyperparameters: dict):
+    if st.toggle("Compute the evaluation metrics", key="evaluation"):
+        st.write(
+            """
+            The out-of-bag predictions also give the metrics below, with their 95% confidence
+            interval computed from 1,000 bootstrap resamples of the samples:
+            """,
+            evaluation_metrics(model, version, hyperparameters),
+        )
+
+
+evaluation_section(model, model_data.version, hyperparameters)
+
 st.write(
     """The model parameters for the model are:"""
 )
@@ -497,9 +662,13 @@ st.write(
     """
 )
 
-input = st.text_area(
-    label="Enter the payload to get predictions, such as the given sample:",
-    value="""[{"c1": "VVk", "c2": "aHRtb", "c3": "c3Y", "c4": "cW1vY", "c6": "KzEwOjAw",
+
+@hotplot.fragment
+def recommendation_section(model: HotModelClassifier, uplift_data: DatasetLoader):
+    # editing the payload only reruns this fragment: the inference, not the whole page
+    input = st.text_area(
+        label="Enter the payload to get predictions, such as the given sample:",
+        value="""[{"c1": "VVk", "c2": "aHRtb", "c3": "c3Y", "c4": "cW1vY", "c6": "KzEwOjAw",
 "n1": 919.491878, "n2": 3439.61554, "n3": 3.628679, "n4": 0.060963,
 "n5": 1220.191514, "n6": 794768584.697085, "n7": 1373818.119745, "n8": 2871.977813,
 "n10": 35545017295.76872, "n11": 58.621714, "n12": 0.287334, "n13": 247.261582, "n14": 3.540294,
@@ -507,36 +676,69 @@ input = st.text_area(
 "c6": "KzAyOjAw",  "n1": 2.414766, "n2": 8.643291, "n3": 1.372131, "n4": 29.678661,
 "n5": 3.950505, "n6": 1.009164, "n7": 0.015539, "n8": 14.672125, "n10": 0.00359,
 "n11": 0.008302, "n12": 0.025759, "n13": 2.502559, "n14": 0.00353, "n15": 123}]""",
-)
-
-try:
-    input_payload_data = json.loads(input)
-except Exception:
-    st.warning("Payload error. Try to fix the problem")
-    st.stop()
-
-input_df = pd.DataFrame(input_payload_data)
-try:
-    result = model.predict(payload=input_df)
-except Exception:
-    st.warning("Payload is wrong.")
-    st.stop()
-
-st.write("The input payload to get variant recommendations is:")
-st.write(input_df)
-
-st.write("The recommendation for this payload is:")
-st.write(result)
+    )
+
+    try:
+        input_payload_data = json.loads(input)
+    except Exception:
+        st.warning("Payload error. Try to fix the problem")
+        return
+
+    input_df = pd.DataFrame(input_payload_data)
+    try:
+        result = model.predict(payload=input_payload_data)
+    except Exception:
+        st.warning("Payload is wrong.")
+        return
+
+    st.write("The input payload to get variant recommendations is:")
+    st.write(input_df)
+
+    st.write("The recommendation for this payload is:")
+    st.write(result)
+
+    st.write(
+        """
+        The classifier above predicts the variant a user *was shown*, which is not necessarily
+        the one that would make them spend more. The uplift recommender below estimates the
+        revenue `n14` and the engagement `n13` of every user under both variants, from the
+        features known before the test, and recommends the variant with the highest revenue
+        among those losing at most the given share of engagement compared to variant *A*:
+        """
+    )
+    # trained on demand, it fits several forests
+    if not st.toggle("Recommend from the uplift", key="uplift"):
+        return
+    recommender = train_uplift_recommender(
+        uplift_data.data, uplift_data.version, os.environ.get("model_path")
+    )
+    max_engagement_loss = st.slider(
+        "Maximum engagement loss", min_value=0.0, max_value=0.5, value=0.0, step=0.01
+    )
+    try:
+        uplift = recommender.explain(input_payload_data, max_engagement_loss=max_engagement_loss)
+    except Exception:
+        st.warning("Payload is wrong.")
+        return
+    st.write(uplift)
+
+
+uplift_data = unclipped.then("materialize", columns=UPLIFT_FEATURES + ["variant", "n13", "n14"])
+recommendation_section(model, uplift_data)
+
+if profile is not None:
+    profile.stop()
+    profile_sidebar(profile)
 
 
 st.info(
     """
-    We could do much more, but since this is only an example, I will let other validation
-    techniques such as Cross-validation score and Hyperparameter Tunning as a `TODO` for
-    future versions.
+    The model can be taken further outside of this page: `HotModelClassifier.cross_validate`
+    runs a parallel k-fold cross validation, `python -m hotmodel.tuning` searches its
+    hyperparameters (see the README), and `pipeline_builder` also takes `one_hot_features`,
+    one-hot encoded into a sparse matrix.
 
-    Also, I could implemente other `Imputers` and `Transformers` such as the `one-hot-encoder`
-    and `feature-normalizer`.
-    But I will let this as a TODO as well.
+    Other `Imputers` and `Transformers`, such as a `feature-normalizer`, are left as a TODO for
+    future versions.
     """
 )
@@ -0,0 +1,290 @@
+"""Significance tests for the variant decision of the A/B experiment.
+
+`compare_variants` compares a control and a treatment variant on several metrics (e.g. `n13`
+for engagement and `n14` for revenue), for the whole population and for every value of the
+segment columns (e.g. `c1` to `c6`) in a single call. Every statistic is computed from group
+level aggregates, so the cost grows with the number of rows, not with the number of segments.
+"""
+
+from __future__ import annotations
+
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy import stats as scipy_stats
+
+from hotmodel.metrics import bootstrap_weights
+from hotmodel.profiling import profiled
+
+OVERALL = "all"
+
+
+def _group_sums(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Sums of the rows of `values` (sorted by group) for each group starting at `starts`."""
+    return np.add.reduceat(values, starts, axis=0)
+
+
+def _welch(mean_a, var_a, n_a, mean_b, var_b, n_b, confidence: float):
+    se_a, se_b = var_a / n_a, var_b / n_b
+    se = np.sqrt(se_a + se_b)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = (mean_b - mean_a) / se
+        df = (se_a + se_b) ** 2 / (se_a**2 / (n_a - 1) + se_b**2 / (n_b - 1))
+    p = 2 * scipy_stats.t.sf(np.abs(t), df)
+    margin = scipy_stats.t.ppf(0.5 + confidence / 2, df) * se
+    return t, df, p, margin
+
+
+def _mann_whitney(values: np.ndarray, segment: np.ndarray, treatment: np.ndarray, n_segments: int):
+    """Two-sided asymptotic Mann-Whitney U test of every metric in every segment, with tie
+    and continuity corrections (same as `scipy.stats.mannwhitneyu(method="asymptotic")`)."""
+    frame = pd.DataFrame(values)
+    ranks = frame.groupby(segment, sort=False).rank(method="average").to_numpy()
+    n_b = np.bincount(segment, weights=treatment, minlength=n_segments)
+    n = np.bincount(segment, minlength=n_segments).astype(np.float64)
+    n_a = n - n_b
+
+    rank_sum_b = np.stack(
+        [
+            np.bincount(segment, weights=ranks[:, j] * treatment, minlength=n_segments)
+            for j in range(values.shape[1])
+        ],
+        axis=1,
+    )
+    u_b = rank_sum_b - (n_b * (n_b + 1) / 2)[:, None]
+
+    ties = np.zeros((n_segments, values.shape[1]))
+    for j in range(values.shape[1]):
+        sizes = frame.groupby([segment, values[:, j]], sort=False).size()
+        t = sizes.to_numpy(dtype=np.float64)
+        np.add.at(ties[:, j], sizes.index.get_level_values(0).to_numpy(), t**3 - t)
+
+    mu = (n_a * n_b / 2)[:, None]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sigma = np.sqrt(
+            (n_a * n_b / 12)[:, None] * ((n + 1)[:, None] - ties / (n * (n - 1))[:, None])
+        )
+        z = (np.abs(u_b - mu) - 0.5) / sigma
+    p = np.minimum(2 * scipy_stats.norm.sf(z), 1.0)
+    return u_b, p
+
+
+def _bootstrap_diff(
+    values: np.ndarray,
+    groups: list[np.ndarray],
+    n_groups: list[int],
+    n_bootstrap: int,
+    confidence: float,
+    seed: Optional[int],
+    max_block_elements: int,
+) -> list[tuple[np.ndarray, np.ndarray]]:
+    """Percentile bootstrap CIs of mean(treatment) - mean(control) for every segment column.
+
+    `groups` holds, per segment column, the group of each row (`2 * s + 1` being the treatment
+    of segment `s`, -1 for rows without segment). All the groups of all the columns go into one
+    sparse (rows x groups) design of counts and metric sums, so each block of bootstrap
+    replicates (`metrics.bootstrap_weights`) needs a single sparse product over the rows,
+    however many segments there are.
+    """
+    n, m = values.shape
+    offsets = np.cumsum([0] + n_groups)
+    rows, cols = [], []
+    for group, offset in zip(groups, offsets):
+        observed = np.flatnonzero(group >= 0)
+        rows.append(observed)
+        cols.append(group[observed] + offset)
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    total = offsets[-1]
+    design = sparse.hstack(
+        [sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, total))]
+        + [sparse.csr_matrix((values[rows, j], (rows, cols)), shape=(n, total)) for j in range(m)],
+        format="csr",
+    ).T.tocsr()
+
+    diffs = []
+    for weights in bootstrap_weights(n, n_bootstrap, seed, max_block_elements):
+        sums = (design @ weights.T.astype(np.float64)).T
+        counts = sums[:, :total]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.stack(
+                [sums[:, total * (j + 1) : total * (j + 2)] / counts for j in range(m)], axis=2
+            )
+        diffs.append(means[:, 1::2] - means[:, 0::2])
+    diffs = np.concatenate(diffs)
+
+    alpha = (1 - confidence) / 2
+    with np.errstate(invalid="ignore"):
+        lower, upper = np.nanquantile(diffs, [alpha, 1 - alpha], axis=0)
+    # pairs of groups never straddle two columns since every column has an even group count
+    bounds = np.cumsum([0] + [g // 2 for g in n_groups])
+    return [(lower[i:j], upper[i:j]) for i, j in zip(bounds[:-1], bounds[1:])]
+
+
+def _compare_segments(
+    values: np.ndarray,
+    covariate: Optional[np.ndarray],
+    segment: np.ndarray,
+    treatment: np.ndarray,
+    n_segments: int,
+    confidence: float,
+    ci_lower: np.ndarray,
+    ci_upper: np.ndarray,
+) -> dict[str, np.ndarray]:
+    group = segment * 2 + treatment
+    order = np.argsort(group, kind="stable")
+    values, group, segment, treatment = (
+        values[order],
+        group[order],
+        segment[order],
+        treatment[order],
+    )
+    n_groups = 2 * n_segments
+
+    counts = np.bincount(group, minlength=n_groups).astype(np.float64)
+    present = np.flatnonzero(counts)
+    starts = np.searchsorted(group, present)
+
+    def per_group(x: np.ndarray) -> np.ndarray:
+        result = np.full((n_groups,) + x.shape[1:], np.nan)
+        result[present] = _group_sums(x, starts)
+        return result
+
+    sums, squares = per_group(values), per_group(values**2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts[:, None]
+        variances = (squares - counts[:, None] * means**2) / (counts[:, None] - 1)
+    n_a, n_b = counts[0::2, None], counts[1::2, None]
+    mean_a, mean_b = means[0::2], means[1::2]
+    var_a, var_b = variances[0::2], variances[1::2]
+
+    t, df, p, margin = _welch(mean_a, var_a, n_a, mean_b, var_b, n_b, confidence)
+    u, mw_p = _mann_whitney(values, segment, treatment, n_segments)
+    result = {
+        "n_control": np.broadcast_to(n_a, mean_a.shape),
+        "n_treatment": np.broadcast_to(n_b, mean_b.shape),
+        "mean_control": mean_a,
+        "mean_treatment": mean_b,
+        "diff": mean_b - mean_a,
+        "relative_diff": (mean_b - mean_a) / mean_a,
+        "ci_lower": ci_lower,
+        "ci_upper": ci_upper,
+        "welch_t": t,
+        "welch_df": df,
+        "welch_p": p,
+        "mann_whitney_u": u,
+        "mann_whitney_p": mw_p,
+    }
+
+    if covariate is not None:
+        # CUPED: y - theta * (x - mean(x)), theta = cov(x, y) / var(x) pooled by segment
+        x = covariate[order]
+        x_sums, x_squares = per_group(x[:, None]), per_group((x**2)[:, None])
+        xy = per_group(values * x[:, None])
+        seg_n = n_a + n_b
+        seg_x = x_sums[0::2] + x_sums[1::2]
+        seg_y = sums[0::2] + sums[1::2]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cov_xy = (xy[0::2] + xy[1::2] - seg_x * seg_y / seg_n) / (seg_n - 1)
+            var_x = (x_squares[0::2] + x_squares[1::2] - seg_x**2 / seg_n) / (seg_n - 1)
+            theta = cov_xy / var_x
+
+            x_means = x_sums / counts[:, None]
+            x_vars = (x_squares - counts[:, None] * x_means**2) / (counts[:, None] - 1)
+            cov = (xy - counts[:, None] * x_means * means) / (counts[:, None] - 1)
+            theta_groups = np.repeat(theta, 2, axis=0)
+            adjusted = variances + theta_groups**2 * x_vars - 2 * theta_groups * cov
+            adjusted_means = means - theta_groups * x_means
+        adj_a, adj_b = adjusted_means[0::2], adjusted_means[1::2]
+        t, df, p, margin = _welch(
+            adj_a, adjusted[0::2], n_a, adj_b, adjusted[1::2], n_b, confidence
+        )
+        diff = adj_b - adj_a
+        with np.errstate(invalid="ignore", divide="ignore"):
+            reduction = 1 - (adjusted[0::2] / n_a + adjusted[1::2] / n_b) / (
+                var_a / n_a + var_b / n_b
+            )
+        result.update(
+            {
+                "cuped_theta": theta,
+                "cuped_diff": diff,
+                "cuped_ci_lower": diff - margin,
+                "cuped_ci_upper": diff + margin,
+                "cuped_p": p,
+                "cuped_variance_reduction": reduction,
+            }
+        )
+    return result
+
+
+@profiled
+def compare_variants(
+    data: pd.DataFrame,
+    metrics: list[str],
+    group: str = "variant",
+    control: str = "A",
+    treatment: str = "B",
+    segments: Optional[list[str]] = None,
+    covariate: Optional[str] = None,
+    n_bootstrap: int = 1000,
+    confidence: float = 0.95,
+    seed: Optional[int] = 0,
+    max_block_elements: int = 2**24,
+) -> pd.DataFrame:
+    """Compare `treatment` against `control` on every metric, overall and per segment.
+
+    For each (segment column, segment value, metric) the result holds the group sizes and
+    means, the difference in means (treatment - control) with its percentile bootstrap CI,
+    the Welch t-test and the Mann-Whitney U test. With a pre-experiment `covariate` (e.g.
+    `n1`), the CUPED adjusted difference, its CI, p-value and variance reduction are added.
+
+    Rows of other variants, rows with missing metrics or covariate, and missing segment
+    values are left out.
+    """
+    columns = metrics + ([covariate] if covariate is not None else [])
+    in_test = data[group].isin([control, treatment]).to_numpy()
+    complete = ~data[columns].isna().any(axis=1).to_numpy()
+    data = data[in_test & complete]
+
+    values = data[metrics].to_numpy(dtype=np.float64)
+    x = data[covariate].to_numpy(dtype=np.float64) if covariate is not None else None
+    is_treatment = data[group].eq(treatment).to_numpy(dtype=np.int64)
+
+    keyed = [(OVERALL, np.zeros(len(data), dtype=np.int64), pd.Index([OVERALL]))]
+    for c in segments or []:
+        codes, uniques = pd.factorize(data[c], sort=True)
+        keyed.append((c, codes, pd.Index(uniques)))
+
+    intervals = _bootstrap_diff(
+        values,
+        [np.where(codes >= 0, codes * 2 + is_treatment, -1) for _, codes, _ in keyed],
+        [2 * len(uniques) for _, _, uniques in keyed],
+        n_bootstrap,
+        confidence,
+        seed,
+        max_block_elements,
+    )
+
+    frames = []
+    for (name, codes, uniques), (ci_lower, ci_upper) in zip(keyed, intervals):
+        observed = codes >= 0
+        result = _compare_segments(
+            values[observed],
+            x[observed] if x is not None else None,
+            codes[observed],
+            is_treatment[observed],
+            len(uniques),
+            confidence,
+            ci_lower,
+            ci_upper,
+        )
+        index = pd.MultiIndex.from_product(
+            [[name], uniques.astype(object), metrics], names=["segment", "value", "metric"]
+        )
+        frames.append(
+            pd.DataFrame({k: np.asarray(v).ravel() for k, v in result.items()}, index=index)
+        )
+    result = pd.concat(frames)
+    result[["n_control", "n_treatment"]] = result[["n_control", "n_treatment"]].astype("int64")
+    return result
@@ -0,0 +1,241 @@
+"""Out-of-core backend: lazy, read-only views over a partitioned Parquet dataset.
+
+`ArrowFrame` stands in for the `DataFrame` held by a `DatasetLoader` created with
+`backend="arrow"`. Column selections, row filters and clipping are recorded as Arrow
+projections and filters, and nothing is read until the data is consumed batch by batch with
+`iter_batches`. The `stats`, `resampling` and `pipeline` functions accept it in place of a
+`DataFrame` and only materialize their (small) aggregated results.
+"""
+
+from __future__ import annotations
+
+import shutil
+import uuid
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+except ImportError:  # pragma: no cover
+    pa = None
+
+BATCH_SIZE = 1_000_000
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("The arrow backend requires `pyarrow`")
+
+
+def _arrow_type(dtype) -> "pa.DataType":
+    if isinstance(dtype, pd.CategoricalDtype) or dtype in ("category", "string", object):
+        # stored as plain strings, parquet dictionary-encodes them on disk anyway
+        return pa.string()
+    if dtype in ("boolean", bool):
+        return pa.bool_()
+    return pa.from_numpy_dtype(np.dtype(dtype))
+
+
+def write_parquet_dataset(
+    chunks: Iterable[pd.DataFrame],
+    directory: str | Path,
+    dtypes: dict[str, object],
+    partition_by: Optional[list[str]] = None,
+) -> Path:
+    """Stream `chunks` into a hive partitioned Parquet dataset, one chunk in memory at a time.
+
+    The dataset is written next to `directory` and moved there once complete, so a directory
+    that exists always holds a whole dataset.
+    """
+    _require_pyarrow()
+    directory = Path(directory)
+    schema = pa.schema([(c, _arrow_type(dtype)) for c, dtype in dtypes.items()])
+    batches = (
+        pa.RecordBatch.from_pandas(chunk.astype(_pandas_input(dtypes)), schema=schema)
+        for chunk in chunks
+    )
+    tmp_directory = directory.with_name(f".{directory.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        ds.write_dataset(
+            batches,
+            tmp_directory,
+            schema=schema,
+            format="parquet",
+            partitioning=partition_by or None,
+            partitioning_flavor="hive" if partition_by else None,
+            existing_data_behavior="overwrite_or_ignore",
+        )
+        tmp_directory.rename(directory)
+    finally:
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+    return directory
+
+
+def _pandas_input(dtypes: dict[str, object]) -> dict[str, object]:
+    # categories differ from one chunk to another, the strings behind them do not
+    return {c: object for c, dtype in dtypes.items() if _arrow_type(dtype) == pa.string()}
+
+
+def open_parquet_dataset(
+    directory: str | Path, dtypes: dict[str, object], partition_by: Optional[list[str]] = None
+) -> ArrowFrame:
+    """`ArrowFrame` of a dataset written by `write_parquet_dataset`, columns in schema order."""
+    _require_pyarrow()
+    schema = pa.schema([(c, _arrow_type(dtype)) for c, dtype in dtypes.items()])
+    partitioning = None
+    if partition_by:
+        # explicit types, so partition values such as "1" are not inferred as integers
+        fields = pa.schema([schema.field(c) for c in partition_by])
+        partitioning = ds.partitioning(fields, flavor="hive")
+    dataset = ds.dataset(directory, schema=schema, format="parquet", partitioning=partitioning)
+    return ArrowFrame(dataset)
+
+
+class ArrowFrame:
+    """Read-only lazy view of a Parquet dataset, with the part of the `DataFrame` API the
+    analysis needs: `columns`, `dtypes`, `shape`, column selection, `drop`, `head`."""
+
+    def __init__(
+        self,
+        dataset: "ds.Dataset",
+        columns: Optional[list[str]] = None,
+        projections: Optional[dict[str, "pc.Expression"]] = None,
+        filter: Optional["pc.Expression"] = None,
+        categorical: Optional[list[str]] = None,
+    ):
+        _require_pyarrow()
+        self.dataset = dataset
+        self._columns = list(columns) if columns is not None else dataset.schema.names
+        self._projections = dict(projections or {})
+        self._filter = filter
+        string_columns = [f.name for f in dataset.schema if pa.types.is_string(f.type)]
+        self._categorical = categorical if categorical is not None else string_columns
+
+    def _derive(self, **changes) -> ArrowFrame:
+        state = {
+            "columns": self._columns,
+            "projections": self._projections,
+            "filter": self._filter,
+            "categorical": self._categorical,
+        }
+        return ArrowFrame(self.dataset, **{**state, **changes})
+
+    @property
+    def columns(self) -> pd.Index:
+        return pd.Index(self._columns)
+
+    @property
+    def dtypes(self) -> pd.Series:
+        return self.head(0).dtypes
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.dataset.count_rows(filter=self._filter), len(self._columns)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def copy(self, deep: bool = True) -> ArrowFrame:
+        # nothing is ever modified in place, so a frame can be shared as is
+        return self
+
+    def __getitem__(self, columns: list[str]) -> ArrowFrame:
+        if not isinstance(columns, list):
+            raise TypeError("Select the columns of an ArrowFrame with a list of names")
+        unknown = set(columns) - set(self._columns)
+        if unknown:
+            raise KeyError(f"Unknown columns: {sorted(unknown)}")
+        return self._derive(columns=columns)
+
+    def drop(self, columns: list[str], axis: int = 1, errors: str = "raise") -> ArrowFrame:
+        if axis != 1:
+            raise ValueError("Only columns can be dropped from an ArrowFrame")
+        unknown = set(columns) - set(self._columns)
+        if unknown and errors == "raise":
+            raise KeyError(f"Unknown columns: {sorted(unknown)}")
+        return self._derive(columns=[c for c in self._columns if c not in columns])
+
+    def where(self, expression: "pc.Expression") -> ArrowFrame:
+        """Rows matching `expression`, on top of the current filter."""
+        current = self._filter
+        return self._derive(filter=expression if current is None else current & expression)
+
+    def clip(self, bounds: dict[str, tuple[float, float]]) -> ArrowFrame:
+        """Columns clipped to their (lower, upper) bounds, missing values stay missing."""
+        projections = dict(self._projections)
+        for c, (lower, upper) in bounds.items():
+            expression = projections.get(c, pc.field(c))
+            expression = pc.min_element_wise(expression, pa.scalar(float(upper)), skip_nulls=False)
+            projections[c] = pc.max_element_wise(
+                expression, pa.scalar(float(lower)), skip_nulls=False
+            )
+        return self._derive(projections=projections)
+
+    def drop_na_in_group(self, col: str, group: str) -> ArrowFrame:
+        """Same rows as `resampling.drop_na_in_group`, in dataset order."""
+        complete = None
+        for c in self._columns:
+            valid = self._expression(c).is_valid()
+            complete = valid if complete is None else complete & valid
+        keep = pc.field(col).is_null() | (pc.field(col) != group)
+        return self.where(keep | complete if complete is not None else keep)
+
+    def _expression(self, c: str) -> "pc.Expression":
+        return self._projections.get(c, pc.field(c))
+
+    def iter_batches(
+        self, columns: Optional[list[str]] = None, batch_size: int = BATCH_SIZE
+    ) -> Iterator[pd.DataFrame]:
+        """Yield the rows as `DataFrame` chunks of at most `batch_size` rows."""
+        columns = list(columns) if columns is not None else self._columns
+        scanner = self.dataset.scanner(
+            columns={c: self._expression(c) for c in columns},
+            filter=self._filter,
+            batch_size=batch_size,
+        )
+        for batch in scanner.to_batches():
+            if batch.num_rows:
+                yield self._to_pandas(batch, columns)
+
+    def _to_pandas(self, batch: "pa.RecordBatch | pa.Table", columns: list[str]) -> pd.DataFrame:
+        # same dtypes as `DatasetLoader.load_data`: nullable booleans and sorted categories
+        data = batch.to_pandas(types_mapper={pa.bool_(): pd.BooleanDtype()}.get)
+        for c in columns:
+            if c in self._categorical:
+                data[c] = data[c].astype("category")
+        return data
+
+    def null_counts(self) -> tuple[pd.Series, int]:
+        """Missing values of every column and the number of rows, without converting them."""
+        counts = np.zeros(len(self._columns), dtype=np.int64)
+        n_rows = 0
+        scanner = self.dataset.scanner(
+            columns={c: self._expression(c) for c in self._columns}, filter=self._filter
+        )
+        for batch in scanner.to_batches():
+            n_rows += batch.num_rows
+            counts += [column.null_count for column in batch.columns]
+        return pd.Series(counts, index=self._columns), n_rows
+
+    def head(self, n: int = 5) -> pd.DataFrame:
+        """The first `n` rows, reading no more of the dataset than needed."""
+        table = self.dataset.scanner(
+            columns={c: self._expression(c) for c in self._columns}, filter=self._filter
+        ).head(n)
+        return self._to_pandas(table, self._columns)
+
+    def to_pandas(self, columns: Optional[list[str]] = None) -> pd.DataFrame:
+        """Materialize the rows of `columns` (all of them by default) in memory."""
+        columns = list(columns) if columns is not None else self._columns
+        table = self.dataset.scanner(
+            columns={c: self._expression(c) for c in columns}, filter=self._filter
+        ).to_table()
+        return self._to_pandas(table, columns)
+
+    def __repr__(self) -> str:
+        return f"ArrowFrame(columns={self._columns})"
@@ -0,0 +1,312 @@
+"""Benchmarks of the analysis and model stages on synthetic data of increasing size.
+
+Every stage of the app (loading, parsing, missing value statistics, undersampling, clipping,
+training and prediction) runs on a synthetic dataset of each requested size (see
+`hotmodel.synthetic`). Stages are timed over `repeat` runs, then run once more under
+`tracemalloc` for their peak memory, so the tracing overhead never shows in the timings.
+`tracemalloc` does not see the buffers allocated by pyarrow (e.g. by the pyarrow CSV engine of
+`load`), so that run also samples the peak bytes allocated by pyarrow and the peak resident set
+size of the process above the one it started with.
+Results are written as JSON, together with the library versions and the git commit, so runs
+can be compared over time:
+
+    python -m hotmodel.benchmark --rows 50000 1000000 10000000 \
+        --output .cache/benchmarks/results.json --baseline .cache/benchmarks/previous.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import numpy as np
+import pandas as pd
+import sklearn
+
+from hotmodel import stats, synthetic
+from hotmodel.data_loader import DatasetLoader
+from hotmodel.model import HotModelClassifier
+from hotmodel.pipeline import OPERATIONS
+from hotmodel.resampling import drop_na_in_group
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover
+    pa = None
+
+# bump whenever the layout of the results changes
+RESULTS_VERSION = 2
+SCHEMA = {
+    "categorical_columns": ["c1", "c2", "c3", "c4", "c6", "variant"],
+    "numerical_columns": [f"n{i}" for i in range(1, 15)],
+    "boolean_columns": ["c5"],
+}
+ORDINAL_FEATURES = ["c1", "c2", "c3", "c4", "c6"]
+FEATURES = ORDINAL_FEATURES + [f"n{i}" for i in range(1, 15) if i not in (9, 13)]
+HYPERPARAMETERS = {"n_estimators": 5, "max_depth": 10, "oob_score": True}
+PREDICT_ROWS = 10_000
+
+
+@dataclass
+class Stage:
+    """A benchmarked step: `setup` prepares its (untimed) input from the outputs of the
+    previous stages, `run` is timed and its output is stored under `name` for the next ones."""
+
+    name: str
+    run: Callable[[Any], Any]
+    setup: Callable[[dict[str, Any]], Any]
+
+
+def _load_untyped(path: Path) -> DatasetLoader:
+    dataloader = DatasetLoader(path=str(path))
+    dataloader.load_data()
+    return dataloader
+
+
+def _parse(dataloader: DatasetLoader) -> pd.DataFrame:
+    dataloader.parse_column_types(
+        numerical_columns=SCHEMA["numerical_columns"],
+        categorical_columns=SCHEMA["categorical_columns"],
+        boolean_columns=SCHEMA["boolean_columns"],
+    )
+    return dataloader.data
+
+
+def _load(path: Path) -> pd.DataFrame:
+    return DatasetLoader(path=str(path)).load_data(**SCHEMA)
+
+
+def _clip(data: pd.DataFrame) -> pd.DataFrame:
+    cols = [c for c in SCHEMA["numerical_columns"] if c in data.columns]
+    return stats.multi_col_clip(data, cols, 0.05, 0.95)
+
+
+def _train(data: pd.DataFrame) -> HotModelClassifier:
+    fill_category = OPERATIONS["fill_category"][0]
+    data = fill_category(data.copy(), col="c2", value="missing")
+    model = HotModelClassifier(data=data, features=FEATURES, hyperparameters=HYPERPARAMETERS)
+    transformed = model.pipeline_builder(ordinal_features=ORDINAL_FEATURES, one_hot_features=None)
+    model.train(transformed, target="variant")
+    return model
+
+
+def _predict_setup(outputs: dict[str, Any]) -> tuple[HotModelClassifier, pd.DataFrame]:
+    data = outputs["clip"]
+    rows = data.iloc[:PREDICT_ROWS][FEATURES].astype({c: object for c in ORDINAL_FEATURES})
+    return outputs["train"], rows
+
+
+STAGES = [
+    Stage("load", _load, lambda outputs: outputs["path"]),
+    Stage("load_untyped", _load_untyped, lambda outputs: outputs["path"]),
+    # parsing modifies the loaded frame, so every run parses a fresh copy of it
+    Stage("parse_column_types", _parse, lambda outputs: _copy_loader(outputs["load_untyped"])),
+    Stage("missing_values", stats.get_percentage_missing_values, lambda outputs: outputs["load"]),
+    Stage(
+        "categorical_substats",
+        lambda data: stats.get_categorical_substats_by_variant_and_column(data, ORDINAL_FEATURES),
+        lambda outputs: outputs["load"],
+    ),
+    Stage(
+        "undersample_na",
+        lambda data: drop_na_in_group(data, col="variant", group="A"),
+        lambda outputs: outputs["load"].drop(["c5", "n9"], axis=1),
+    ),
+    Stage("clip", _clip, lambda outputs: outputs["undersample_na"]),
+    Stage("train", _train, lambda outputs: outputs["clip"]),
+    Stage("predict", lambda args: args[0].predict(args[1]), _predict_setup),
+]
+
+
+def _copy_loader(dataloader: DatasetLoader) -> DatasetLoader:
+    copied = DatasetLoader(path=str(dataloader.path))
+    copied.data = dataloader.data.copy()
+    return copied
+
+
+def _rows(output: Any) -> Optional[int]:
+    if isinstance(output, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(output)
+    if isinstance(output, HotModelClassifier):
+        return len(output.data)
+    return None
+
+
+def _rss() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _MemorySampler:
+    """Peak bytes allocated by pyarrow and peak resident set size above their values on entry,
+    polled every `interval` seconds from a background thread (None when not available)."""
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.peak_arrow_bytes: Optional[int] = None
+        self.peak_rss_delta: Optional[int] = None
+        self._stop = threading.Event()
+
+    def _sample(self):
+        arrow = pa.total_allocated_bytes() if pa is not None else None
+        rss = _rss()
+        if arrow is not None:
+            self.peak_arrow_bytes = max(self.peak_arrow_bytes, arrow - self._arrow_start)
+        if rss is not None and self._rss_start is not None:
+            self.peak_rss_delta = max(self.peak_rss_delta, rss - self._rss_start)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self) -> _MemorySampler:
+        self._arrow_start = pa.total_allocated_bytes() if pa is not None else None
+        self._rss_start = _rss()
+        if self._arrow_start is not None:
+            self.peak_arrow_bytes = 0
+        if self._rss_start is not None:
+            self.peak_rss_delta = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def _format_bytes(value: Optional[int], label: str) -> str:
+    return "" if value is None else f" {value / 2**20:>10.1f} MiB {label}"
+
+
+def run_stage(stage: Stage, outputs: dict[str, Any], repeat: int = 3) -> dict[str, Any]:
+    """Wall and CPU times of `repeat` runs of `stage`, its peak traced memory and, from the same
+    run, the peak bytes allocated by pyarrow and the peak growth of the resident set size."""
+    wall_times, cpu_times = [], []
+    for _ in range(repeat):
+        value = stage.setup(outputs)
+        wall, cpu = time.perf_counter(), time.process_time()
+        output = stage.run(value)
+        wall_times.append(time.perf_counter() - wall)
+        cpu_times.append(time.process_time() - cpu)
+
+    value = stage.setup(outputs)
+    tracemalloc.start()
+    try:
+        with _MemorySampler() as sampler:
+            stage.run(value)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    outputs[stage.name] = output
+    return {
+        "stage": stage.name,
+        "rows": _rows(output),
+        "wall_time_min": min(wall_times),
+        "wall_time_median": statistics.median(wall_times),
+        "cpu_time_median": statistics.median(cpu_times),
+        "peak_memory_bytes": peak,
+        "peak_arrow_bytes": sampler.peak_arrow_bytes,
+        "peak_rss_delta_bytes": sampler.peak_rss_delta,
+    }
+
+
+def run_benchmarks(
+    sizes: list[int],
+    data_dir: str | Path = ".cache/benchmarks/data",
+    repeat: int = 3,
+    seed: int = 0,
+) -> dict[str, Any]:
+    """Run every stage on a synthetic dataset of every size.
+
+    The datasets are written to `data_dir` once and reused by later runs with the same seed.
+    """
+    results = []
+    for n_rows in sizes:
+        path = Path(data_dir) / f"synthetic-{n_rows}-{seed}.csv"
+        if not path.exists():
+            synthetic.write_csv(path, n_rows, seed=seed)
+        outputs: dict[str, Any] = {"path": path}
+        for stage in STAGES:
+            result = {"n_rows": n_rows, **run_stage(stage, outputs, repeat=repeat)}
+            print(
+                f"{n_rows:>12,} {stage.name:<22} {result['wall_time_median']:>9.3f}s "
+                f"{result['peak_memory_bytes'] / 2**20:>10.1f} MiB"
+                + _format_bytes(result["peak_arrow_bytes"], "arrow")
+                + _format_bytes(result["peak_rss_delta_bytes"], "RSS")
+            )
+            results.append(result)
+    return {
+        "results_version": RESULTS_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "sklearn": sklearn.__version__,
+        },
+        "repeat": repeat,
+        "seed": seed,
+        "results": results,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit.stdout.strip()
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any]) -> pd.DataFrame:
+    """Median wall time and peak memory of every stage and size, relative to `baseline`."""
+    index = ["n_rows", "stage"]
+    columns = ["wall_time_median", "peak_memory_bytes"]
+    current = pd.DataFrame(results["results"]).set_index(index)[columns]
+    previous = pd.DataFrame(baseline["results"]).set_index(index)[columns]
+    ratio = (current / previous).dropna(how="all")
+    return ratio.rename(columns={c: f"{c}_ratio" for c in columns})
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the hotmodel stages.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[50_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=".cache/benchmarks/data")
+    parser.add_argument("--output", default=".cache/benchmarks/results.json")
+    parser.add_argument("--baseline", default=None, help="Results of a previous run to compare to")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.rows, data_dir=args.data_dir, repeat=args.repeat, seed=args.seed)
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"Written to {output}")
+    if args.baseline is not None:
+        baseline = json.loads(Path(args.baseline).read_text())
+        print(compare(results, baseline).to_string(float_format="{:.2f}".format))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Compact in-memory representation of the experiment data.
+
+Text columns become `category` (integer codes, which pandas sizes to the number of categories,
+plus one copy of every distinct value) and float columns are downcast to the smallest float
+type that keeps every value within a relative tolerance. Floats stay floats even when they only
+hold whole numbers, since the numerical features are recognized by their float dtype (see
+`DatasetLoader.numerical_feature_names`). A downcast is only kept when no value overflows or
+underflows the new type, so large features such as `n6` and `n10` never leave float32.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from hotmodel.profiling import profiled
+
+FLOAT_CANDIDATES = (np.float16, np.float32)
+
+
+def _float_dtype(values: np.ndarray, rtol: float):
+    """Smallest float type holding `values` within `rtol`, or None when float64 is needed."""
+    finite = values[np.isfinite(values)]
+    for dtype in FLOAT_CANDIDATES:
+        info = np.finfo(dtype)
+        magnitude = np.abs(finite)
+        nonzero = magnitude[magnitude > 0]
+        if magnitude.size and magnitude.max() > info.max:
+            continue
+        # subnormal values lose precision quickly, so the smallest one must stay normal
+        if nonzero.size and nonzero.min() < info.smallest_normal:
+            continue
+        cast = finite.astype(dtype).astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            error = np.abs(cast - finite) / np.abs(finite)
+        if not finite.size or np.nanmax(np.where(finite == 0, 0, error)) <= rtol:
+            return dtype
+    return None
+
+
+def compact_dtypes(data: pd.DataFrame, rtol: float = 1e-6) -> dict[str, object]:
+    """Dtype of every column that can be stored more compactly, see `compact`."""
+    dtypes = {}
+    for c in data.columns:
+        column = data[c]
+        if pd.api.types.is_object_dtype(column.dtype) or pd.api.types.is_string_dtype(column.dtype):
+            if not isinstance(column.dtype, pd.CategoricalDtype):
+                dtypes[c] = "category"
+        elif pd.api.types.is_integer_dtype(column.dtype) and isinstance(column.dtype, np.dtype):
+            dtype = pd.to_numeric(column, downcast="integer").dtype
+            if dtype.itemsize < column.dtype.itemsize:
+                dtypes[c] = dtype
+        elif pd.api.types.is_float_dtype(column.dtype):
+            values = column.to_numpy(dtype=np.float64, na_value=np.nan)
+            dtype = _float_dtype(values, rtol)
+            if dtype is not None and np.dtype(dtype).itemsize < column.dtype.itemsize:
+                dtypes[c] = np.dtype(dtype)
+    return dtypes
+
+
+@profiled
+def compact(data: pd.DataFrame, rtol: float = 1e-6) -> pd.DataFrame:
+    """Copy of `data` with text columns as `category` and floats downcast within `rtol`.
+
+    Only the converted columns are copied.
+    """
+    dtypes = compact_dtypes(data, rtol=rtol)
+    return data.astype(dtypes) if dtypes else data.copy(deep=False)
+
+
+@profiled
+def memory_report(before: pd.DataFrame, after: pd.DataFrame) -> pd.DataFrame:
+    """Dtype, memory and largest relative change of every column between two frames."""
+    bytes_before = before.memory_usage(deep=True, index=False)
+    bytes_after = after.memory_usage(deep=True, index=False)
+    errors = {}
+    for c in after.columns:
+        if pd.api.types.is_numeric_dtype(before[c].dtype) and not pd.api.types.is_bool_dtype(
+            before[c].dtype
+        ):
+            old = before[c].to_numpy(dtype=np.float64, na_value=np.nan)
+            new = after[c].to_numpy(dtype=np.float64, na_value=np.nan)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                error = np.where(old == new, 0, np.abs(new - old) / np.abs(old))
+            errors[c] = np.nanmax(error) if error.size else 0.0
+    report = pd.DataFrame(
+        index=after.columns,
+        data={
+            "dtype_before": before.dtypes.astype(str),
+            "dtype_after": after.dtypes.astype(str),
+            "bytes_before": bytes_before,
+            "bytes_after": bytes_after,
+            "max_relative_error": pd.Series(errors, dtype=np.float64),
+        },
+    )
+    report.loc["total"] = [None, None, bytes_before.sum(), bytes_after.sum(), np.nan]
+    return report
@@ -1,17 +1,74 @@
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import os
+import shutil
+import uuid
 from pathlib import Path
+from typing import Iterator, Optional
 
 import pandas as pd
 
-from typing import Optional
+from hotmodel.arrow_frame import ArrowFrame, open_parquet_dataset, write_parquet_dataset
+from hotmodel.compact import compact as compact_frame
+from hotmodel.compact import memory_report
+from hotmodel.pipeline import DEFAULT_MEMORY_BUDGET, OPERATIONS, FrameCache, step_key
+from hotmodel.profiling import count_rows, profiled, stage
+from hotmodel.stats import get_boxplot_summary
+
+try:
+    import pyarrow  # noqa: F401
+
+    CSV_ENGINE = "pyarrow"
+except ImportError:
+    CSV_ENGINE = "c"
+
+CACHE_FORMATS = ("feather", "parquet")
+BACKENDS = ("pandas", "arrow")
+# columns the Parquet dataset of the arrow backend is partitioned by, when in the schema
+PARTITION_COLUMNS = ["variant"]
 
 
 class DatasetLoader:
+    """Loads the CSV file and derives immutable versions of it.
+
+    `then` records a transformation step and returns a new loader for the resulting version,
+    without running it. The data of a version is computed when `data` is read, starting from
+    the closest version already available, and results are kept in a least recently used cache
+    of at most `memory_budget` bytes shared by the loader and all its versions. Every version
+    is identified by `version`, a key built from the source file, the schema and the steps.
+
+    With `backend="arrow"` the CSV file is converted once to a Parquet dataset in `cache_dir`
+    and `data` is an `ArrowFrame`, a lazy view of it that the `stats` functions and the
+    pipeline steps consume batch by batch, so the data never has to fit in memory.
+    """
+
     def __init__(
         self,
         path: str,
+        cache_dir: Optional[str] = None,
+        cache_format: str = "feather",
+        memory_budget: int = DEFAULT_MEMORY_BUDGET,
+        backend: str = "pandas",
     ) -> None:
+        if cache_format not in CACHE_FORMATS:
+            raise ValueError(f"cache_format must be one of {CACHE_FORMATS}, got: {cache_format}")
+        if backend not in BACKENDS:
+            raise ValueError(f"backend must be one of {BACKENDS}, got: {backend}")
         self.path = path
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        if backend == "arrow" and (self.cache_dir is None or not isinstance(self.path, Path)):
+            raise ValueError("The arrow backend needs a local source and a `cache_dir`")
+        self.cache_format = cache_format
+        self.backend = backend
+        self.version: Optional[str] = None
         self._data = None
+        self._parent: Optional[DatasetLoader] = None
+        self._step: Optional[tuple[str, dict]] = None
+        self._frames = FrameCache(memory_budget)
+        self.memory_report: Optional[pd.DataFrame] = None
 
     @property
     def path(self):
@@ -33,18 +90,271 @@ class DatasetLoader:
     @property
     def data(self) -> pd.DataFrame:
         """The data property."""
+        if self._parent is not None:
+            return self._evaluate()
         return self._data
 
     @data.setter
     def data(self, value: pd.DataFrame):
+        # frames given from outside have no known content, so they get a version of their own
         self._data = value
+        self._parent, self._step = None, None
+        self.version = uuid.uuid4().hex[:16]
+
+    def then(self, operation: str, **params) -> DatasetLoader:
+        """A new version of the data with the registered `operation` applied, see `pipeline`.
+
+        Nothing runs until the `data` of the returned loader is read.
+        """
+        if self.version is None:
+            raise ValueError("Load the data before adding transformation steps")
+        derived = copy.copy(self)
+        derived._data = None
+        derived._parent, derived._step = self, (operation, params)
+        derived.version = step_key(self.version, operation, params)
+        return derived
+
+    def _evaluate(self) -> pd.DataFrame:
+        # walk back to the closest version whose data is available
+        pending = []
+        node, data = self, self._frames.get(self.version)
+        while data is None and node._parent is not None:
+            pending.append(node)
+            node = node._parent
+            data = node._data if node._parent is None else self._frames.get(node.version)
+        if data is None:
+            raise ValueError("The source has no data yet, call `load_data` first")
+
+        pending.reverse()
+        owned = False
+        for i, node in enumerate(pending):
+            function, inplace = OPERATIONS[node._step[0]]
+            if inplace and not owned:
+                data = data.copy()
+            with stage(f"pipeline.{node._step[0]}", rows=count_rows(data)) as opened:
+                data = function(data, **node._step[1])
+                if opened is not None:
+                    opened.rows_out = count_rows(data)
+            owned = inplace
+            # a result about to be modified in place by the next step is not kept
+            last = i == len(pending) - 1
+            if last or not OPERATIONS[pending[i + 1]._step[0]][1]:
+                self._frames.put(node.version, data)
+                owned = False
+        return data
+
+    @profiled
+    def load_data(
+        self,
+        numerical_columns: Optional[list[str]] = None,
+        categorical_columns: Optional[list[str]] = None,
+        boolean_columns: Optional[list[str]] = None,
+        float_dtype: str = "float64",
+        compact: bool = False,
+        rtol: float = 1e-6,
+    ) -> pd.DataFrame:
+        """Load the CSV file.
+
+        When a schema is given only its columns are read, in the order of the file, and their
+        final dtypes are set at parse time, so there is no need to call `parse_column_types`
+        afterwards.
+
+        With a `cache_dir` the parsed frame is also written as a typed columnar file, and later
+        loads of the same source and schema read that file instead of parsing the CSV again.
+
+        With `compact=True` the frame is kept in its compact representation (see
+        `hotmodel.compact`, floats are downcast within the relative tolerance `rtol`) and
+        `memory_report` tells the memory saved and the precision lost by every column.
+
+        With the arrow backend the schema is required, the Parquet dataset takes the place of
+        the cache file and `data` is an `ArrowFrame` of it. `compact` is not supported.
+        """
+        dtypes = self.build_dtypes(
+            numerical_columns=numerical_columns,
+            categorical_columns=categorical_columns,
+            boolean_columns=boolean_columns,
+            float_dtype=float_dtype,
+        )
+        dtypes = self._in_file_order(dtypes)
+        if self.backend == "arrow":
+            if not dtypes or compact:
+                raise ValueError("The arrow backend needs a schema and does not support compact")
+            self.data = self._open_dataset(dtypes)
+            self.version = f"arrow-{self.fingerprint(dtypes)}"
+            return self.data
+        cache_path = self.cache_path(dtypes)
+        data = self._read_cache(cache_path, dtypes) if cache_path is not None else None
+        if data is None:
+            if dtypes:
+                data = pd.read_csv(self.path, usecols=list(dtypes), dtype=dtypes, engine=CSV_ENGINE)
+            else:
+                data = pd.read_csv(self.path)
+            if data.empty:
+                raise pd.errors.EmptyDataError
+            if cache_path is not None:
+                self._write_cache(data, cache_path, dtypes)
+        version = self.fingerprint(dtypes)
+        if compact:
+            compacted = compact_frame(data, rtol=rtol)
+            self.memory_report = memory_report(data, compacted)
+            # same version as `then("compact", rtol=rtol)` on the full representation
+            data, version = compacted, step_key(version, "compact", {"rtol": rtol})
+        self.data = data
+        self.version = version
+        return data
+
+    def iter_chunks(
+        self,
+        chunksize: int = 1_000_000,
+        numerical_columns: Optional[list[str]] = None,
+        categorical_columns: Optional[list[str]] = None,
+        boolean_columns: Optional[list[str]] = None,
+        float_dtype: str = "float64",
+    ) -> Iterator[pd.DataFrame]:
+        """Yield the CSV file in typed chunks of `chunksize` rows, without keeping it in memory.
 
-    def load_data(self) -> pd.DataFrame:
-        data = pd.read_csv(self.path)
-        if data.empty:
-            raise pd.errors.EmptyDataError
-        self._data = data
+        The chunks are parsed with the same schema handling as `load_data` and are meant to be
+        consumed by `stats.StreamingStats`. `data` is left untouched.
+        """
+        dtypes = self.build_dtypes(
+            numerical_columns=numerical_columns,
+            categorical_columns=categorical_columns,
+            boolean_columns=boolean_columns,
+            float_dtype=float_dtype,
+        )
+        return self._iter_chunks(self._in_file_order(dtypes), chunksize)
 
+    def _iter_chunks(self, dtypes: dict[str, str], chunksize: int = 1_000_000):
+        kwargs = {"usecols": list(dtypes), "dtype": dtypes} if dtypes else {}
+        # the pyarrow engine does not support chunked reads
+        with pd.read_csv(self.path, chunksize=chunksize, engine="c", **kwargs) as reader:
+            yield from reader
+
+    def _open_dataset(self, dtypes: dict[str, str]) -> ArrowFrame:
+        directory = self.cache_path(dtypes)
+        partition_by = [c for c in PARTITION_COLUMNS if c in dtypes]
+        if not directory.exists():
+            directory.parent.mkdir(parents=True, exist_ok=True)
+            for stale in directory.parent.glob(f"{self._cache_prefix(dtypes)}-*.dataset"):
+                shutil.rmtree(stale, ignore_errors=True)
+            chunks = self._iter_chunks(dtypes)
+            write_parquet_dataset(chunks, directory, dtypes, partition_by=partition_by)
+        return open_parquet_dataset(directory, dtypes, partition_by=partition_by)
+
+    @profiled
+    def summary(self, quantiles: tuple[float, ...] = (0.05, 0.95)) -> pd.DataFrame:
+        """`stats.get_boxplot_summary` of the numerical features, computed once per `version`.
+
+        The summary is reused until `data` is assigned again, so a frame modified in place must be
+        assigned back to `data` to refresh it.
+        """
+        key = f"{self.version}/summary/{json.dumps(list(quantiles))}"
+        summary = self._frames.get(key)
+        if summary is None:
+            summary = get_boxplot_summary(
+                self.data, self.numerical_feature_names, quantiles=tuple(quantiles)
+            )
+            self._frames.put(key, summary)
+        return summary
+
+    def _in_file_order(self, dtypes: dict[str, str]) -> dict[str, str]:
+        # the pyarrow engine returns `usecols` in the given order and the C engine in file order,
+        # so both keep the column order of the file when given the columns in header order
+        if not dtypes:
+            return dtypes
+        header = pd.read_csv(self.path, nrows=0).columns
+        # columns missing from the file are left at the end, for `read_csv` to report them
+        return {**{c: dtypes[c] for c in header if c in dtypes}, **dtypes}
+
+    def fingerprint(self, dtypes: dict[str, str]) -> str:
+        """Version key of the current source and schema.
+
+        The key covers the resolved source path, its mtime and size and the schema, so any change
+        to the CSV or to the requested dtypes gives a different key. Remote sources cannot be
+        stat'ed and are keyed by their URL and schema only.
+        """
+        if isinstance(self.path, Path):
+            source = self.path.resolve()
+            stat = source.stat()
+            key = {"source": str(source), "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+        else:
+            key = {"source": self.path}
+        key = json.dumps({**key, "schema": dtypes}, sort_keys=True)
+        return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+    def cache_path(self, dtypes: dict[str, str]) -> Optional[Path]:
+        """Cache file for the current source and schema, named after its `fingerprint`.
+
+        With the arrow backend this is the directory of the Parquet dataset. Remote sources are
+        never cached.
+        """
+        if self.cache_dir is None or not isinstance(self.path, Path):
+            return None
+        digest = self.fingerprint(dtypes)
+        suffix = "dataset" if self.backend == "arrow" else self.cache_format
+        return self.cache_dir / f"{self._cache_prefix(dtypes)}-{digest}.{suffix}"
+
+    def _cache_prefix(self, dtypes: dict[str, str]) -> str:
+        # entries share a prefix only for the same source and schema, so loading the source with
+        # another schema does not evict them
+        source = self.path.resolve()
+        source_hash = hashlib.sha256(str(source).encode()).hexdigest()[:8]
+        schema_hash = hashlib.sha256(json.dumps(dtypes, sort_keys=True).encode()).hexdigest()[:8]
+        return f"{source.stem}-{source_hash}-{schema_hash}"
+
+    def _read_cache(self, cache_path: Path, dtypes: dict[str, str]) -> Optional[pd.DataFrame]:
+        if not cache_path.exists():
+            return None
+        try:
+            if self.cache_format == "feather":
+                from pyarrow import feather
+
+                # uncompressed Arrow IPC files are memory-mapped instead of read into memory
+                data = feather.read_table(cache_path, memory_map=True).to_pandas()
+            else:
+                data = pd.read_parquet(cache_path, engine="pyarrow")
+        except ImportError:
+            # pyarrow missing is not a corrupted entry, the entry is kept
+            raise
+        except Exception:
+            # a truncated or otherwise corrupted entry is dropped and rebuilt from the source
+            cache_path.unlink(missing_ok=True)
+            return None
+        if dtypes and list(data.columns) != list(dtypes):
+            # written with another column order
+            cache_path.unlink(missing_ok=True)
+            return None
+        return data
+
+    def _write_cache(self, data: pd.DataFrame, cache_path: Path, dtypes: dict[str, str]):
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # entries of older versions of the same source and schema are stale as soon as a new one
+        # is written
+        for stale in cache_path.parent.glob(f"{self._cache_prefix(dtypes)}-*.{self.cache_format}"):
+            stale.unlink(missing_ok=True)
+
+        tmp_path = cache_path.with_name(f".{cache_path.name}.{os.getpid()}.tmp")
+        if self.cache_format == "feather":
+            data.reset_index(drop=True).to_feather(tmp_path, compression="uncompressed")
+        else:
+            data.to_parquet(tmp_path, engine="pyarrow")
+        os.replace(tmp_path, cache_path)
+
+    @staticmethod
+    def build_dtypes(
+        numerical_columns: Optional[list[str]] = None,
+        categorical_columns: Optional[list[str]] = None,
+        boolean_columns: Optional[list[str]] = None,
+        float_dtype: str = "float64",
+    ) -> dict[str, str]:
+        dtypes = {}
+        dtypes.update({c: float_dtype for c in numerical_columns or []})
+        dtypes.update({c: "category" for c in categorical_columns or []})
+        # nullable booleans keep missing values as <NA> instead of turning them into True
+        dtypes.update({c: "boolean" for c in boolean_columns or []})
+        return dtypes
+
+    @profiled
     def parse_column_types(
         self,
         numerical_columns: list[str],
@@ -52,16 +362,17 @@ class DatasetLoader:
         boolean_columns: list[str],
     ):
         if self._data is not None:
-            self._data = self._data.drop("id", axis=1)
+            self._data = self._data.drop("id", axis=1, errors="ignore")
             self._data[numerical_columns] = self._data[numerical_columns].astype(float)
             self._data[categorical_columns] = self._data[categorical_columns].astype(
                 pd.StringDtype()
             )
             self._data[boolean_columns] = self._data[boolean_columns].astype(bool)
+            self.data = self._data
 
     @property
     def numerical_feature_names(self) -> Optional[list[str]]:
-        if self._data is not None:
-            t = self._data.dtypes.reset_index().rename({0: 'type', 'index': 'feature_name'}, axis=1)
-            features = t[t['type'] == 'float']
-            return list(features['feature_name'])
+        data = self.data
+        if data is not None:
+            dtypes = data.dtypes
+            return [c for c in dtypes.index if pd.api.types.is_float_dtype(dtypes[c])]
@@ -1,12 +1,21 @@
+import pandas as pd
 import seaborn as sns
 import streamlit as st
 from matplotlib import pyplot as plt
 
+from hotmodel import resampling, stats
 from hotmodel.data_loader import DatasetLoader
+from hotmodel.profiling import profiled
 
 sns.set_theme()
 
+# widgets in a fragment only rerun the fragment. Streamlit added `st.fragment` in 1.37 (as
+# `st.experimental_fragment` in 1.33), older versions rerun the whole page instead
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", lambda f: f)
 
+
+@fragment
+@profiled
 def numerical_feature_container_boxplot(
     dataloader: DatasetLoader, key: int, min_bound: float = 0.05, max_bound: float = 0.95
 ):
@@ -17,49 +26,117 @@ def numerical_feature_container_boxplot(
             placeholder="Chose the numerical feature to analyze",
             key=key,
         )
+        summary = dataloader.summary(quantiles=(min_bound, max_bound)).loc[chosen]
         st.markdown(
             f"""By observing the boxplot, it is possible to see that the feature `{chosen}`
-            has the interquartile range of { dataloader.data[chosen].quantile(min_bound),
-            dataloader.data[chosen].quantile(max_bound)} considering the quantiles of
-            (lower, upper) bound of **{min_bound, max_bound}**.""",
+            has the interquartile range of {summary[min_bound], summary[max_bound]} considering
+            the quantiles of (lower, upper) bound of **{min_bound, max_bound}**.""",
         )
         st.markdown(
-            """Quantile ranges here are computed with
+            """Quantile ranges here are computed once per dataset by `stats.get_boxplot_summary`,
+            with the same interpolation as
             [pandas.Series.quantile](https://pandas.pydata.org/docs/reference/api/pandas.Series.quantile.html)
             """
         )
         fig, ax = plt.subplots(nrows=1, ncols=1, figsize=(10, 5))
-        sns.boxplot(ax=ax, data=dataloader.data[chosen], orient="v", notch=True)
+        _summary_boxplot(summary, label=chosen, ax=ax)
         st.pyplot(fig)
 
 
-def engagement_vs_revenue_multiplot(
-    dataloader: DatasetLoader, group: str, engagement: str, revenue: str
+def _summary_boxplot(summary: pd.Series, label: str, ax):
+    """Notched boxplot drawn from precomputed statistics, styled like `sns.boxplot`."""
+    color = sns.color_palette()[0]
+    width = plt.rcParams["lines.linewidth"] * 0.75
+    line = {"color": ".26", "linewidth": width}
+    box = summary[["med", "q1", "q3", "whislo", "whishi", "cilo", "cihi", "fliers"]].to_dict()
+    ax.bxp(
+        [box],
+        shownotches=True,
+        patch_artist=True,
+        widths=0.8,
+        boxprops={"facecolor": color, "edgecolor": ".26", "linewidth": width},
+        whiskerprops=line,
+        capprops=line,
+        medianprops=line,
+        flierprops={"marker": "d", "markerfacecolor": ".26", "markeredgecolor": ".26"},
+    )
+    ax.set_xticks([])
+    ax.set_ylabel(label)
+
+
+def _percentile_barplot(
+    summary: pd.DataFrame, group: str, col: str, order: list, palette: dict, ax
 ):
-    dist = (
-        dataloader.data.reset_index()[["index", group, engagement, revenue]]
-        .groupby(group)
-        .agg({"index": "count"})
-        .rename({"index": "count"}, axis=1)
+    """Bars of the precomputed means with their precomputed percentile interval."""
+    sns.barplot(x=order, y=summary[(col, "mean")].to_numpy(), hue=order, palette=palette, ax=ax)
+    ax.errorbar(
+        x=range(len(order)),
+        y=summary[(col, "mean")],
+        yerr=[
+            summary[(col, "mean")] - summary[(col, "lower")],
+            summary[(col, "upper")] - summary[(col, "mean")],
+        ],
+        fmt="none",
+        ecolor=".26",
+        elinewidth=plt.rcParams["lines.linewidth"] * 1.8,
     )
+    ax.set_xlabel(group)
+
+
+@profiled
+def engagement_vs_revenue_multiplot(
+    dataloader: DatasetLoader,
+    group: str,
+    engagement: str,
+    revenue: str,
+    max_points: int = 50_000,
+    scatter: str = "sample",
+):
+    """Count, engagement vs revenue and 95% percentile interval bars of every `group`.
+
+    Above `max_points` rows the scatter plot is drawn from a sample of `max_points` rows
+    stratified by `group` (`scatter="sample"`) or replaced by a hexbin density of every row
+    (`scatter="hexbin"`). The bars are drawn from one groupby aggregate, so the render time
+    barely depends on the number of rows.
+    """
+    if scatter not in ("sample", "hexbin"):
+        raise ValueError(f"scatter must be either 'sample' or 'hexbin', got: {scatter}")
+    data = dataloader.data
+    dist = data.groupby(group, observed=True).size().rename("count").reset_index()
+    order = dist[group].tolist()
+    palette = dict(zip(order, sns.color_palette(n_colors=len(order))))
+    # lets use the percentile interval (pi) for errorbar. The default is to use 95% -> [2.5, 97.5]
+    summary = stats.get_mean_and_percentile_interval(data, group, [engagement, revenue])
+
     fig, ax = plt.subplots(nrows=2, ncols=2, figsize=(10, 10))
     fig.suptitle("Scatter and Barplot comparing User Engagement and Revenue for variant A and B\n")
 
-    sns.barplot(data=dist, x=group, y="count", hue=group, ax=ax[0][0])
+    sns.barplot(data=dist, x=group, y="count", hue=group, order=order, palette=palette, ax=ax[0][0])
     ax[0][0].set_ylabel("Count of Users")
     ax[0][0].set_title("Bar plot: Distribution of users per variant")
 
-    sns.scatterplot(data=dataloader.data, x=engagement, y=revenue, ax=ax[0][1], hue=group)
+    title = "Scatter plot: User engagement by Revenue"
+    if data.shape[0] > max_points and scatter == "hexbin":
+        complete = data[[engagement, revenue]].dropna()
+        hexbin = ax[0][1].hexbin(
+            complete[engagement], complete[revenue], gridsize=60, bins="log", mincnt=1
+        )
+        fig.colorbar(hexbin, ax=ax[0][1], label="Count of Users")
+        title = "Hexbin plot: User engagement by Revenue (all variants)"
+    else:
+        if data.shape[0] > max_points:
+            data = resampling.stratified_sample(data, group, max_points)
+            title += f"\n(stratified sample of {max_points:,} users)"
+        sns.scatterplot(data=data, x=engagement, y=revenue, ax=ax[0][1], hue=group, palette=palette)
     ax[0][1].set_xlabel("User engagement")
     ax[0][1].set_ylabel("Revenue")
-    ax[0][1].set_title("Scatter plot: User engagement by Revenue")
+    ax[0][1].set_title(title)
 
-    # lets use the percentile interval (pi) for errorbar. The default is to use 95% -> [2.5, 97.5]
-    sns.barplot(data=dataloader.data, x=group, y=revenue, hue=group, ax=ax[1][0], errorbar="pi")
+    _percentile_barplot(summary, group, revenue, order, palette, ax[1][0])
     ax[1][0].set_title("\nBar plot: Percentile error Interval at 95% \nfor Revenue by Variant")
     ax[1][0].set_ylabel("Revenue")
 
-    sns.barplot(data=dataloader.data, x=group, y=engagement, hue=group, ax=ax[1][1], errorbar="pi")
+    _percentile_barplot(summary, group, engagement, order, palette, ax[1][1])
     ax[1][1].set_ylabel("User engagement")
     ax[1][1].set_title(
         "Bar plot: Percentile error Interval at 95% \nfor User Engagement by Variant"
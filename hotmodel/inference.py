@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+from typing import Any, Iterable, Union
+
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import LabelEncoder, OrdinalEncoder
+
+Payload = Union[pd.DataFrame, Iterable[dict[str, Any]], dict[str, Any], np.ndarray]
+
+
+class CompiledEncoder:
+    """Encodes payloads straight into a contiguous float32 matrix in `features` order, with the
+    category -> code lookup tables of the fitted ordinal encoders of a pipeline, built once.
+
+    This skips the ColumnTransformer, the intermediate DataFrames and the input validation of
+    scikit-learn. Payloads can be a DataFrame, a dict or a list of dicts (one per row), or a 2-D
+    array that is already encoded in `features` order (e.g. the output of `encode`).
+    """
+
+    def __init__(self, pipeline, features: list[str]):
+        self.features = list(features)
+        self.lookups: dict[str, tuple] = {}
+        column_transformer: ColumnTransformer = pipeline.named_steps["column_transformer"]
+        for name, transformer, columns in column_transformer.transformers_:
+            if name == "remainder" and transformer == "drop":
+                continue
+            if not isinstance(transformer, OrdinalEncoder):
+                raise NotImplementedError(
+                    f"Transformer `{name}` is not supported by the compiled inference path"
+                )
+            self.lookups.update(self._build_lookups(transformer))
+
+    @staticmethod
+    def _build_lookups(encoder: OrdinalEncoder) -> dict[str, tuple]:
+        """Category -> code tables, computed with the fitted encoder itself so infrequent
+        categories are grouped exactly as `transform` does."""
+        columns = list(encoder.feature_names_in_)
+        lookups = {}
+        for i, c in enumerate(columns):
+            categories = pd.Index(encoder.categories_[i])
+            probe = pd.DataFrame(
+                {
+                    other: np.repeat(encoder.categories_[j][:1], len(categories))
+                    for j, other in enumerate(columns)
+                }
+            )
+            probe[c] = categories
+            codes = encoder.transform(probe)[:, i].astype(np.float32)
+
+            known = ~categories.isna()
+            lookups[c] = (
+                categories[known],
+                codes[known],
+                np.float32(encoder.unknown_value),
+                np.float32(encoder.encoded_missing_value),
+                dict(zip(categories[known], codes[known].tolist())),
+            )
+        return lookups
+
+    def _encode_column(self, c: str, values) -> np.ndarray:
+        if c not in self.lookups:
+            if isinstance(values, pd.Series):
+                return values.to_numpy(dtype=np.float32, na_value=np.nan)
+            return np.asarray(values, dtype=np.float32)
+
+        categories, codes, unknown_value, missing_value, mapping = self.lookups[c]
+        if isinstance(values, list):
+            # plain dict lookups beat building an Index for the few rows of a JSON payload
+            return np.array(
+                [
+                    missing_value if v is None or v != v else mapping.get(v, unknown_value)
+                    for v in values
+                ],
+                dtype=np.float32,
+            )
+        if isinstance(values, pd.Series) and isinstance(values.dtype, pd.CategoricalDtype):
+            # look up each category once and broadcast through the integer codes
+            positions = categories.get_indexer(values.cat.categories)
+            table = np.where(positions >= 0, codes[positions], unknown_value)
+            table = np.append(table, missing_value).astype(np.float32)
+            return table[values.cat.codes.to_numpy()]
+
+        values = pd.Index(np.asarray(values, dtype=object))
+        positions = categories.get_indexer(values)
+        encoded = np.where(positions >= 0, codes[positions], unknown_value)
+        encoded[values.isna()] = missing_value
+        return encoded.astype(np.float32, copy=False)
+
+    def check_features(self, columns) -> None:
+        """Raise a ValueError naming the features missing from `columns` (or from the keys of a
+        row), like the sklearn pipeline does instead of scoring them as missing values."""
+        missing = [c for c in self.features if c not in columns]
+        if missing:
+            raise ValueError(f"Missing features: {missing}")
+
+    def encode(self, payload: Payload) -> np.ndarray:
+        """Encode a payload into a C-contiguous float32 matrix in `features` order."""
+        if isinstance(payload, np.ndarray):
+            if payload.ndim != 2 or payload.shape[1] != len(self.features):
+                raise ValueError(
+                    f"Expected an encoded array of shape (n, {len(self.features)}), "
+                    f"got: {payload.shape}"
+                )
+            return np.ascontiguousarray(payload, dtype=np.float32)
+
+        if isinstance(payload, dict):
+            payload = [payload]
+        if isinstance(payload, pd.DataFrame):
+            self.check_features(payload.columns)
+            columns = {c: payload[c] for c in self.features}
+            n_rows = payload.shape[0]
+        else:
+            payload = list(payload)
+            for row in payload:
+                self.check_features(row)
+            columns = {c: [row[c] for row in payload] for c in self.features}
+            n_rows = len(payload)
+
+        X = np.empty((n_rows, len(self.features)), dtype=np.float32)
+        for j, c in enumerate(self.features):
+            values = columns[c]
+            if c not in self.lookups and not isinstance(values, pd.Series):
+                # None in JSON payloads stands for a missing numerical value
+                values = [np.nan if v is None else v for v in values]
+            X[:, j] = self._encode_column(c, values)
+        return X
+
+
+class CompiledPredictor(CompiledEncoder):
+    """Low-latency inference path for a fitted `HotModelClassifier`: payloads are encoded with
+    `CompiledEncoder` and scored by the trees of the forest directly."""
+
+    def __init__(
+        self,
+        pipeline,
+        model: RandomForestClassifier,
+        label_encoder: LabelEncoder,
+        features: list[str],
+    ):
+        super().__init__(pipeline, features)
+        self.model = model
+        self.estimators = list(model.estimators_)
+        # labels in the order of the columns of predict_proba
+        self.labels = label_encoder.inverse_transform(model.classes_.astype(int))
+
+    def predict_proba(self, payload: Payload) -> np.ndarray:
+        X = self.encode(payload)
+        proba = np.zeros((X.shape[0], len(self.labels)), dtype=np.float64)
+        for estimator in self.estimators:
+            proba += estimator.predict_proba(X, check_input=False)
+        proba /= len(self.estimators)
+        return proba
+
+    def predict(self, payload: Payload) -> np.ndarray:
+        return self.labels[self.predict_proba(payload).argmax(axis=1)]
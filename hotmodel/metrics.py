@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+def bootstrap_weights(
+    n: int, n_bootstrap: int, seed: Optional[int] = 0, max_block_elements: int = 2**24
+):
+    """Yield blocks of bootstrap replicates as `(replicates, n)` count matrices.
+
+    Every block is drawn at once as a matrix of resampled row indices, which is turned into how
+    many times each row was drawn. Metrics that are means over rows then become one matrix
+    product per block. Blocks are sized to hold at most `max_block_elements` indices.
+    """
+    rng = np.random.default_rng(seed)
+    block = max(1, min(n_bootstrap, max_block_elements // max(n, 1)))
+    for start in range(0, n_bootstrap, block):
+        size = min(block, n_bootstrap - start)
+        indices = rng.integers(0, n, size=(size, n))
+        indices += np.arange(size)[:, None] * n
+        yield np.bincount(indices.ravel(), minlength=size * n).reshape(size, n)
+
+
+def _weighted_roc_auc(weights: np.ndarray, positive: np.ndarray, starts: np.ndarray):
+    """Mann-Whitney ROC-AUC of every row of `weights`, for samples sorted by score.
+
+    `starts` are the positions where a new score value begins; tied scores count for one half.
+    """
+    pos = weights * positive
+    neg = weights - pos
+    if len(starts) < weights.shape[1]:
+        pos = np.add.reduceat(pos, starts, axis=1)
+        neg = np.add.reduceat(neg, starts, axis=1)
+    below = np.cumsum(neg, axis=1) - neg
+    n_pos, n_neg = pos.sum(axis=1), neg.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return ((below + 0.5 * neg) * pos).sum(axis=1) / (n_pos * n_neg)
+
+
+def _tie_starts(scores: np.ndarray) -> np.ndarray:
+    return np.flatnonzero(np.r_[True, scores[1:] != scores[:-1]])
+
+
+class _MetricsDesign:
+    """Per-sample indicators of every metric, so all of them are one matrix product away."""
+
+    def __init__(self, y_true: np.ndarray, proba: np.ndarray, labels: Sequence):
+        n_classes = proba.shape[1]
+        if n_classes == 2:
+            # samples sorted by score once: the ROC-AUC then needs no reordering per replicate
+            order = np.argsort(proba[:, 1], kind="stable")
+            y_true, proba = y_true[order], proba[order]
+        self.y_true, self.proba, self.labels = y_true, proba, list(labels)
+
+        y_pred = proba.argmax(axis=1)
+        eps = np.finfo(np.float64).eps
+        columns = {
+            "correct": y_pred == y_true,
+            "loss": -np.log(np.clip(proba[np.arange(len(y_true)), y_true], eps, 1)),
+        }
+        for k in range(n_classes):
+            columns[f"tp_{k}"] = (y_pred == k) & (y_true == k)
+            columns[f"predicted_{k}"] = y_pred == k
+            columns[f"true_{k}"] = y_true == k
+        self.columns = list(columns)
+        self.design = np.column_stack(list(columns.values())).astype(np.float64)
+
+        if n_classes == 2:
+            self.auc_orders = [None]
+            self.auc_starts = [_tie_starts(proba[:, 1])]
+        else:
+            self.auc_orders = [np.argsort(proba[:, k], kind="stable") for k in range(n_classes)]
+            self.auc_starts = [
+                _tie_starts(proba[order, k]) for k, order in enumerate(self.auc_orders)
+            ]
+
+    def metrics(self, weights: np.ndarray) -> dict[str, np.ndarray]:
+        """Metrics of every row of `weights`, given as how many times each sample is counted."""
+        weights = weights.astype(np.float64, copy=False)
+        sums = dict(zip(self.columns, (weights @ self.design).T))
+        total = weights.sum(axis=1)
+        metrics = {"accuracy": sums["correct"] / total, "log_loss": sums["loss"] / total}
+
+        # float32 holds the cumulative counts exactly up to 2**24 rows at half the bandwidth
+        auc_weights = weights.astype(np.float32 if weights.shape[1] < 2**24 else np.float64)
+        if len(self.labels) == 2:
+            metrics["roc_auc"] = _weighted_roc_auc(
+                auc_weights, self.y_true == 1, self.auc_starts[0]
+            )
+        else:
+            metrics["roc_auc"] = np.nanmean(
+                [
+                    _weighted_roc_auc(auc_weights[:, order], self.y_true[order] == k, starts)
+                    for k, (order, starts) in enumerate(zip(self.auc_orders, self.auc_starts))
+                ],
+                axis=0,
+            )
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for k, label in enumerate(self.labels):
+                metrics[f"precision_{label}"] = sums[f"tp_{k}"] / sums[f"predicted_{k}"]
+                metrics[f"recall_{label}"] = sums[f"tp_{k}"] / sums[f"true_{k}"]
+        return metrics
+
+
+def evaluation_metrics(
+    y_true: np.ndarray,
+    proba: np.ndarray,
+    labels: Sequence,
+    n_bootstrap: int = 1000,
+    confidence: float = 0.95,
+    seed: Optional[int] = 0,
+    max_block_elements: int = 2**24,
+) -> pd.DataFrame:
+    """Accuracy, ROC-AUC, log-loss and per-class precision/recall with bootstrap CIs.
+
+    `y_true` holds class positions (0..n_classes-1) matching the columns of `proba`, and
+    `labels` their names. The confidence intervals are the percentile intervals of the metrics
+    over `n_bootstrap` resamples of the rows.
+    """
+    y_true = np.asarray(y_true, dtype=np.int64)
+    proba = np.asarray(proba, dtype=np.float64)
+    n = len(y_true)
+
+    design = _MetricsDesign(y_true, proba, labels)
+    point = design.metrics(np.ones((1, n)))
+    replicates = {name: [] for name in point}
+    for weights in bootstrap_weights(n, n_bootstrap, seed, max_block_elements):
+        for name, values in design.metrics(weights).items():
+            replicates[name].append(values)
+
+    alpha = (1 - confidence) / 2
+    rows = {}
+    for name, value in point.items():
+        values = np.concatenate(replicates[name])
+        lower, upper = np.nanquantile(values, [alpha, 1 - alpha])
+        rows[name] = {"value": value[0], "ci_lower": lower, "ci_upper": upper}
+    result = pd.DataFrame.from_dict(rows, orient="index")
+    result.index.name = "metric"
+    return result
@@ -1,12 +1,30 @@
 from __future__ import annotations
 
-from typing import Any
+import hashlib
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Optional
 
+import joblib
+import numpy as np
 import pandas as pd
+import sklearn
+from sklearn.base import clone
 from sklearn.compose import ColumnTransformer
 from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score, log_loss, roc_auc_score
+from sklearn.model_selection import StratifiedKFold
 from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import LabelEncoder, OrdinalEncoder
+from sklearn.preprocessing import LabelEncoder, OneHotEncoder, OrdinalEncoder
+
+from hotmodel.inference import CompiledEncoder, CompiledPredictor, Payload
+from hotmodel.metrics import evaluation_metrics
+from hotmodel.profiling import profiled
+
+# bump whenever the content of the saved artifact changes
+ARTIFACT_VERSION = 1
 
 
 class HotModelClassifier:
@@ -32,18 +50,48 @@ class HotModelClassifier:
 
     def build_one_hot_encoder(
         self,
-        data: pd.DataFrame,
         one_hot_features: list[str],
+        min_frequency: int = 100,
+        max_categories: Optional[int] = 50,
     ):
-        print(len(data), len(one_hot_features))
-        raise NotImplementedError("The one hot encoder transformer is not ready yet.")
+        """Sparse one-hot encoder. Categories seen less than `min_frequency` times, and all but
+        the `max_categories - 1` most frequent ones, share a single infrequent column, which
+        unknown categories are encoded in too."""
+        encoder = OneHotEncoder(
+            min_frequency=min_frequency,
+            max_categories=max_categories,
+            handle_unknown="infrequent_if_exist",
+            sparse_output=True,
+            dtype=np.float32,
+        )
+        return "one_hot_encoder", encoder, one_hot_features
+
+    @profiled
+    def pipeline_builder(self, ordinal_features: list[str], one_hot_features: Optional[list[str]]):
+        """Fit the preprocessing pipeline on the data and return the data to `train` on.
 
-    def pipeline_builder(self, ordinal_features: list[str], one_hot_features: list[str]):
+        Without `one_hot_features` the encoded columns replace the original ones in a DataFrame.
+        With them, the whole feature matrix (ordinal codes, one-hot columns and the remaining
+        features) is a CSR matrix that `train` and `predict` build from the raw columns, so the
+        one-hot columns are never densified. The raw data is then returned: the forest does not
+        handle missing values in sparse matrices, so the remaining features must have none.
+        """
+        self.ordinal_features = ordinal_features
+        self.one_hot_features = one_hot_features
         transformers = []
         transformers.append(self.build_ordinal_enconder(ordinal_features=ordinal_features))
 
-        # Todo: implement the logic for hot encoder transformer.
-        # transformers.append(build_one_hot_encoder(ordinal_features=ordinal_features))
+        if one_hot_features:
+            transformers.append(self.build_one_hot_encoder(one_hot_features=one_hot_features))
+            encoded = ordinal_features + one_hot_features
+            transformers.append(
+                ("numerical", "passthrough", [c for c in self.features if c not in encoded])
+            )
+            column_transformer = ColumnTransformer(transformers, sparse_threshold=1.0)
+            self.pipeline = Pipeline([("column_transformer", column_transformer)])
+            self.pipeline.fit(self.data)
+            # `train` sets the target column, the shallow copy keeps it out of `self.data`
+            return self.data.copy(deep=False)
 
         column_transformer = ColumnTransformer(transformers)
         preprocessors = [("column_transformer", column_transformer)]
@@ -56,27 +104,446 @@ class HotModelClassifier:
         data = data.join(df_transformed)
         return data
 
+    @profiled
     def train(self, data: pd.DataFrame, target: str):
         self.label_encoder = LabelEncoder()
         data[target] = self.label_encoder.fit_transform(data.loc[:, "variant"])
 
+        if getattr(self, "one_hot_features", None):
+            X = self.pipeline.transform(data)
+        else:
+            X = data.loc[:, self.features]
         model = RandomForestClassifier(**self.hyperparameters)
-        model.fit(X=data.loc[:, self.features], y=data[target])
+        model.fit(X=X, y=data[target])
         self.model = model
+        self.compile()
+
+    def compile(self) -> Optional[CompiledPredictor]:
+        """Precompute the low-latency inference path used by `predict`.
+
+        Pipelines with transformers the compiled path does not support keep predicting through
+        the sklearn pipeline.
+        """
+        try:
+            self.predictor = CompiledPredictor(
+                pipeline=self.pipeline,
+                model=self.model,
+                label_encoder=self.label_encoder,
+                features=self.features,
+            )
+        except NotImplementedError:
+            self.predictor = None
+        return self.predictor
+
+    @profiled
+    def partial_fit(
+        self,
+        data: pd.DataFrame,
+        target: str = "variant",
+        n_estimators: Optional[int] = None,
+        max_estimators: Optional[int] = None,
+    ) -> HotModelClassifier:
+        """Update the fitted model with a new batch of `data`, without refitting on the earlier
+        batches, so a refresh costs time proportional to the new rows only.
+
+        The categories of the batch the ordinal encoder has not seen yet are added to it (see
+        `extend_ordinal_encoder`), so the codes the existing trees split on never change. Then
+        `n_estimators` trees (by default the `n_estimators` hyperparameter) are fitted on the
+        batch alone and added to the forest. With `max_estimators`, the oldest trees beyond it
+        are retired, so the forest covers a sliding window of the latest batches.
+
+        The out-of-bag estimates of the previous fit no longer hold and are removed: evaluate the
+        updated model on held-out data.
+        """
+        if getattr(self, "one_hot_features", None):
+            raise NotImplementedError("One-hot encoded models cannot be updated incrementally")
+        column_transformer = self.pipeline.named_steps["column_transformer"]
+        for name, transformer, _ in column_transformer.transformers_:
+            if name == "remainder" and transformer == "drop":
+                continue
+            if not isinstance(transformer, OrdinalEncoder):
+                raise NotImplementedError(f"Transformer `{name}` cannot be updated incrementally")
+            extend_ordinal_encoder(transformer, data)
 
-    def predict(self, payload: pd.DataFrame):
+        y = self.label_encoder.transform(data[target])
+        if not np.array_equal(np.unique(y), self.model.classes_):
+            raise ValueError(f"Every class of `{target}` must be present in the batch")
+        hyperparameters = {**self.hyperparameters, "oob_score": False, "warm_start": False}
+        if n_estimators is not None:
+            hyperparameters["n_estimators"] = n_estimators
+        batch_model = RandomForestClassifier(**hyperparameters)
+        batch_model.fit(X=self._model_input(data), y=y)
+
+        estimators = self.model.estimators_ + batch_model.estimators_
+        if max_estimators is not None:
+            estimators = estimators[-max_estimators:]
+        self.model.estimators_ = estimators
+        self.model.n_estimators = len(estimators)
+        self.model.oob_score = False
+        for attribute in ("oob_score_", "oob_decision_function_"):
+            if hasattr(self.model, attribute):
+                delattr(self.model, attribute)
+        self.compile()
+        return self
+
+    def _transform(self, payload: pd.DataFrame) -> pd.DataFrame:
+        """`payload` with the columns of the fitted pipeline replaced by their encoding."""
         payload_transformed = self.pipeline.transform(payload)
         new_col_names = [x.split("__")[1] for x in self.pipeline.get_feature_names_out()]
         payload_transformed = pd.DataFrame(
             payload_transformed, columns=new_col_names, index=payload.index
         )
-        payload = payload.drop(new_col_names, axis=1)
-        payload = payload.join(payload_transformed)
-        result = self.model.predict(payload.loc[:, self.features])
+        return payload.drop(new_col_names, axis=1).join(payload_transformed)
+
+    def _model_input(self, payload: pd.DataFrame):
+        """Features of `payload` as the forest takes them: a CSR matrix when some are one-hot
+        encoded, else a DataFrame."""
+        if getattr(self, "one_hot_features", None):
+            return self.pipeline.transform(payload)
+        return self._transform(payload).loc[:, self.features]
+
+    @profiled
+    def predict(self, payload: Payload):
+        """Predict the variant of each row of a DataFrame, a list of dicts or an encoded array."""
+        if getattr(self, "predictor", None) is not None:
+            return self.predictor.predict(payload)
+        if not isinstance(payload, pd.DataFrame):
+            payload = pd.DataFrame(payload)
+        result = self.model.predict(self._model_input(payload))
         return self.label_encoder.inverse_transform(result)
 
-    def compute_evaluation_metric(self):
-        raise NotImplementedError("Work in progress...")
+    def artifact_key(
+        self, ordinal_features: list[str], one_hot_features: Optional[list[str]], target: str
+    ) -> str:
+        """Hash of everything the fitted model depends on: training data, features,
+        hyperparameters and library versions."""
+        digest = hashlib.sha256()
+        digest.update(pd.util.hash_pandas_object(self.data, index=True).to_numpy().tobytes())
+        digest.update(
+            json.dumps(
+                {
+                    "artifact_version": ARTIFACT_VERSION,
+                    "sklearn_version": sklearn.__version__,
+                    "columns": [[c, str(t)] for c, t in self.data.dtypes.items()],
+                    "features": self.features,
+                    "hyperparameters": self.hyperparameters,
+                    "ordinal_features": ordinal_features,
+                    "one_hot_features": one_hot_features,
+                    "target": target,
+                },
+                sort_keys=True,
+                default=str,
+            ).encode()
+        )
+        return digest.hexdigest()[:16]
+
+    @staticmethod
+    def artifact_path(directory: str | Path, key: str) -> Path:
+        return Path(directory) / f"hotmodel-{key}.joblib"
+
+    def save(self, path: str | Path, key: Optional[str] = None) -> Path:
+        """Serialize the fitted pipeline, label encoder, model, features and hyperparameters."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        artifact = {
+            "artifact_version": ARTIFACT_VERSION,
+            "sklearn_version": sklearn.__version__,
+            "key": key,
+            "pipeline": self.pipeline,
+            "label_encoder": self.label_encoder,
+            "model": self.model,
+            "features": self.features,
+            "hyperparameters": self.hyperparameters,
+            "ordinal_features": getattr(self, "ordinal_features", None),
+            "one_hot_features": getattr(self, "one_hot_features", None),
+        }
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        joblib.dump(artifact, tmp_path)
+        tmp_path.replace(path)
+        return path
+
+    @classmethod
+    def load(
+        cls, path: str | Path, data: Optional[pd.DataFrame] = None, mmap_mode: Optional[str] = None
+    ) -> HotModelClassifier:
+        """Load an artifact written by `save`.
+
+        `mmap_mode` is passed to `joblib.load`, but it does not keep the model on disk: the trees
+        copy their node and value arrays into their own buffers when unpickled, and the encoder
+        categories are object arrays, so the whole model is loaded in memory either way.
+
+        Raises ValueError if the artifact was written by another artifact format or
+        scikit-learn version.
+        """
+        artifact = joblib.load(path, mmap_mode=mmap_mode)
+        if (
+            artifact.get("artifact_version") != ARTIFACT_VERSION
+            or artifact.get("sklearn_version") != sklearn.__version__
+        ):
+            raise ValueError(f"Incompatible model artifact: {path}")
+
+        model = cls(
+            data=data, features=artifact["features"], hyperparameters=artifact["hyperparameters"]
+        )
+        model.pipeline = artifact["pipeline"]
+        model.label_encoder = artifact["label_encoder"]
+        model.model = artifact["model"]
+        model.ordinal_features = artifact["ordinal_features"]
+        model.one_hot_features = artifact["one_hot_features"]
+        model.compile()
+        return model
+
+    @profiled
+    def fit_or_load(
+        self,
+        directory: str | Path,
+        ordinal_features: list[str],
+        one_hot_features: Optional[list[str]],
+        target: str,
+    ) -> HotModelClassifier:
+        """Load the artifact matching the current data and hyperparameters, or fit and save it.
+
+        Unreadable or incompatible artifacts are refit and overwritten.
+        """
+        key = self.artifact_key(ordinal_features, one_hot_features, target)
+        path = self.artifact_path(directory, key)
+        if path.exists():
+            try:
+                loaded = self.load(path, data=self.data)
+            except Exception:
+                pass
+            else:
+                self.__dict__.update(loaded.__dict__)
+                return self
+
+        df_transformed = self.pipeline_builder(
+            ordinal_features=ordinal_features, one_hot_features=one_hot_features
+        )
+        self.train(df_transformed, target=target)
+        self.save(path, key=key)
+        return self
+
+    @profiled
+    def predict_proba(self, payload: Payload) -> np.ndarray:
+        """Class probabilities, with columns in the order of `label_encoder.classes_`."""
+        if getattr(self, "predictor", None) is not None:
+            return self.predictor.predict_proba(payload)
+        if not isinstance(payload, pd.DataFrame):
+            payload = pd.DataFrame(payload)
+        return self.model.predict_proba(self._model_input(payload))
+
+    @profiled
+    def compute_evaluation_metric(
+        self,
+        data: Optional[pd.DataFrame] = None,
+        target: str = "variant",
+        n_bootstrap: int = 1000,
+        confidence: float = 0.95,
+        seed: Optional[int] = 0,
+    ) -> pd.DataFrame:
+        """Accuracy, ROC-AUC, log-loss and per-variant precision/recall with bootstrap
+        confidence intervals.
+
+        Without `data` the out-of-bag predictions of the training data are evaluated (the model
+        must be trained with `oob_score=True`); rows that were never out-of-bag are left out.
+        Otherwise `data` is used as a held-out set.
+        """
+        labels = self.label_encoder.classes_
+        if data is None:
+            if not hasattr(self.model, "oob_decision_function_"):
+                raise ValueError("Train with `oob_score=True` or give held-out `data`")
+            proba = self.model.oob_decision_function_
+            y_true = self.label_encoder.transform(self.data[target])
+            evaluated = ~np.isnan(proba).any(axis=1)
+            proba, y_true = proba[evaluated], y_true[evaluated]
+        else:
+            proba = self.predict_proba(data)
+            y_true = self.label_encoder.transform(data[target])
+
+        # columns of predict_proba follow model.classes_, i.e. the encoded labels
+        positions = np.searchsorted(self.model.classes_, y_true)
+        return evaluation_metrics(
+            positions,
+            proba,
+            labels=labels[self.model.classes_.astype(int)],
+            n_bootstrap=n_bootstrap,
+            confidence=confidence,
+            seed=seed,
+        )
+
+    @profiled
+    def cross_validate(
+        self,
+        data: pd.DataFrame,
+        fold_size: int,
+        target: str = "variant",
+        ordinal_features: Optional[list[str]] = None,
+        one_hot_features: Optional[list[str]] = None,
+        n_jobs: int = -1,
+        random_state: Optional[int] = 0,
+    ) -> pd.DataFrame:
+        """Stratified k-fold cross validation with `fold_size` folds, run in parallel.
+
+        The preprocessing pipeline is fitted on the training part of each fold only. The data is
+        encoded once into a float32 matrix (categories as their sorted codes, which the ordinal
+        and one-hot encoders map exactly like the original values) and shared with the workers
+        as a memory-mapped file instead of being pickled for every fold. Without
+        `ordinal_features`, those of `pipeline_builder` are used, or else every non-numerical
+        feature.
+
+        Returns one row per fold with its metrics, sizes and fit/score timings.
+        """
+        if one_hot_features is None:
+            one_hot_features = getattr(self, "one_hot_features", None) or []
+        if ordinal_features is None:
+            ordinal_features = getattr(self, "ordinal_features", None)
+        if ordinal_features is None:
+            # the pipeline was not built yet: every other non-numerical feature is ordinal
+            ordinal_features = [
+                c
+                for c in self.features
+                if c not in one_hot_features and not pd.api.types.is_numeric_dtype(data[c])
+            ]
+        X = encode_features(data, self.features, ordinal_features + one_hot_features)
+        y = LabelEncoder().fit_transform(data[target])
+        transformers = [
+            self.build_ordinal_enconder(
+                ordinal_features=[self.features.index(c) for c in ordinal_features]
+            )
+        ]
+        if one_hot_features:
+            transformers.append(
+                self.build_one_hot_encoder(
+                    one_hot_features=[self.features.index(c) for c in one_hot_features]
+                )
+            )
+
+        folds = StratifiedKFold(n_splits=fold_size, shuffle=True, random_state=random_state)
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "cross_validate.joblib"
+            joblib.dump((X, y), path)
+            X, y = joblib.load(path, mmap_mode="r")
+            results = joblib.Parallel(n_jobs=n_jobs)(
+                joblib.delayed(_fit_and_score_fold)(
+                    X, y, train, test, transformers, self.hyperparameters, fold
+                )
+                for fold, (train, test) in enumerate(folds.split(np.zeros(len(y)), y))
+            )
+        return pd.DataFrame(results).set_index("fold")
+
+
+def extend_ordinal_encoder(encoder: OrdinalEncoder, data: pd.DataFrame) -> dict[str, list]:
+    """Add the categories of `data` a fitted `encoder` has not seen, in place, and return them
+    by column.
+
+    New categories get codes after the existing ones, which keep their codes: categories that were
+    infrequent stay grouped. Like at fit time, a new category is only added when it appears at
+    least `min_frequency` times in `data`, rarer ones keep being encoded as unknown.
+    """
+    columns = list(encoder.feature_names_in_)
+    before = CompiledEncoder._build_lookups(encoder)
+    mappings = getattr(encoder, "_default_to_infrequent_mappings", [None] * len(columns))
+    min_frequency = encoder.min_frequency or 1
+    if isinstance(min_frequency, float):
+        min_frequency = np.ceil(min_frequency * len(data))
+
+    added = {}
+    for i, c in enumerate(columns):
+        categories = encoder.categories_[i]
+        if categories.dtype.kind != "O":
+            raise NotImplementedError(f"Categories of `{c}` are not strings and cannot be extended")
+        counts = data[c].value_counts()
+        new = counts.index[(counts >= min_frequency) & ~counts.index.isin(categories)].tolist()
+        if not new:
+            continue
+        added[c] = new
+        # the missing category stays last, as `fit` leaves it
+        missing = encoder._missing_indices.get(i)
+        known = categories if missing is None else np.delete(categories, missing)
+        encoder.categories_[i] = np.concatenate(
+            [known, np.array(new, dtype=object), categories[len(known) :]]
+        )
+        if missing is not None:
+            encoder._missing_indices[i] = len(encoder.categories_[i]) - 1
+        if mappings[i] is not None:
+            # infrequent categories share the last code, new codes go after it
+            next_code = mappings[i].max() + 1
+            mappings[i] = np.append(mappings[i], next_code + np.arange(len(new)))
+
+    after = CompiledEncoder._build_lookups(encoder)
+    for c, (categories, codes, *_) in before.items():
+        if [after[c][4][k] for k in categories] != codes.tolist():
+            raise RuntimeError(f"Extending the categories of `{c}` changed their codes")
+    return added
+
+
+def encode_features(
+    data: pd.DataFrame, features: list[str], ordinal_features: list[str]
+) -> np.ndarray:
+    """Float32 matrix of `features`, with the categorical ones replaced by their sorted codes
+    (NaN for missing values)."""
+    X = np.empty((data.shape[0], len(features)), dtype=np.float32)
+    for j, c in enumerate(features):
+        if c in ordinal_features:
+            values = data[c]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                codes = values.cat.codes.to_numpy()
+            else:
+                codes, _ = pd.factorize(values, sort=True)
+            X[:, j] = np.where(codes >= 0, codes, np.nan)
+        else:
+            X[:, j] = data[c].to_numpy(dtype=np.float32, na_value=np.nan)
+    return X
+
+
+def _fit_and_score_fold(
+    X: np.ndarray,
+    y: np.ndarray,
+    train: np.ndarray,
+    test: np.ndarray,
+    transformers: list[tuple[str, Any, list[int]]],
+    hyperparameters: dict[str, Any],
+    fold: int,
+) -> dict[str, Any]:
+    start = time.perf_counter()
+    pipeline = Pipeline(
+        [
+            (
+                "column_transformer",
+                ColumnTransformer(
+                    [(name, clone(encoder), idx) for name, encoder, idx in transformers],
+                    remainder="passthrough",
+                    sparse_threshold=1.0,
+                ),
+            ),
+            # the out-of-bag score of a fold would never be used
+            ("model", RandomForestClassifier(**{**hyperparameters, "oob_score": False})),
+        ]
+    )
+    pipeline.fit(X[train], y[train])
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    proba = pipeline.predict_proba(X[test])
+    y_test = y[test]
+    classes = pipeline.classes_
+    y_pred = classes[proba.argmax(axis=1)]
+    if len(classes) == 2:
+        roc_auc = roc_auc_score(y_test, proba[:, 1])
+    else:
+        roc_auc = roc_auc_score(y_test, proba, multi_class="ovr", labels=classes)
+    metrics = {
+        "accuracy": accuracy_score(y_test, y_pred),
+        "roc_auc": roc_auc,
+        "log_loss": log_loss(y_test, proba, labels=classes),
+    }
+    score_time = time.perf_counter() - start
 
-    def cross_validate(self, data: pd.DataFrame, fold_size: int):
-        raise NotImplementedError("Work in progress...")
+    return {
+        "fold": fold,
+        **metrics,
+        "train_size": len(train),
+        "test_size": len(test),
+        "fit_time": fit_time,
+        "score_time": score_time,
+    }
@@ -0,0 +1,129 @@
+"""Transformation steps of the lazy `DatasetLoader` pipeline and the cache of their results.
+
+A step is a registered operation applied with JSON serializable parameters, so a version of the
+data is fully described by the key of its parent and the step, e.g.
+
+    clipped = loader.then("drop", columns=["c5", "n9"]).then(
+        "clip", cols=["n1", "n2"], lower=0.05, upper=0.95
+    )
+
+Operations flagged as `inplace` modify the frame they get and return it; the pipeline only
+hands them frames nobody else holds, copying the input first when it is shared.
+
+Every operation also runs on the `ArrowFrame` of the out-of-core backend, lazily, except
+`compact` and `fill_category`, which need a `materialize` step first.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import pandas as pd
+
+from hotmodel.arrow_frame import ArrowFrame
+from hotmodel.compact import compact
+from hotmodel.resampling import drop_na_in_group
+from hotmodel.stats import multi_col_clip
+
+DEFAULT_MEMORY_BUDGET = 2**30
+
+# name -> (function(data, **params) -> data, whether it modifies `data` in place)
+OPERATIONS: dict[str, tuple[Callable[..., pd.DataFrame], bool]] = {}
+
+
+def register_operation(name: str, function: Callable[..., pd.DataFrame], inplace: bool = False):
+    """Make `function(data, **params)` available as the step `name` of the pipeline.
+
+    The name is part of the version keys, so a changed function must get a new name.
+    """
+    OPERATIONS[name] = (function, inplace)
+
+
+def step_key(parent_key: str, name: str, params: dict) -> str:
+    if name not in OPERATIONS:
+        raise ValueError(f"Unknown operation: {name}")
+    step = json.dumps([parent_key, name, params], sort_keys=True, default=str)
+    return hashlib.sha256(step.encode()).hexdigest()[:16]
+
+
+class FrameCache:
+    """Least recently used results, evicted once they add up to more than `max_bytes`.
+
+    Thread safe: the loaders the Home page caches with `st.cache_resource`, and their cache, are
+    shared by every session.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MEMORY_BUDGET):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries: OrderedDict[str, tuple[object, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> Optional[object]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key: str, value: object):
+        size = _nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            while self.nbytes + size > self.max_bytes:
+                self.nbytes -= self._entries.popitem(last=False)[1][1]
+            self._entries[key] = (value, size)
+            self.nbytes += size
+
+
+def _nbytes(value: object) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    return 0
+
+
+def _drop(data: pd.DataFrame, columns: list[str]) -> pd.DataFrame:
+    return data.drop(columns, axis=1)
+
+
+def _undersample_na(data: pd.DataFrame, col: str, group: str) -> pd.DataFrame:
+    return drop_na_in_group(data, col=col, group=group)
+
+
+def _clip(data: pd.DataFrame, cols: list[str], lower: float, upper: float) -> pd.DataFrame:
+    return multi_col_clip(data, cols, lower, upper, inplace=True)
+
+
+def _materialize(data: pd.DataFrame, columns: Optional[list[str]] = None) -> pd.DataFrame:
+    if isinstance(data, ArrowFrame):
+        return data.to_pandas(columns)
+    return data if columns is None else data[columns]
+
+
+def _fill_category(data: pd.DataFrame, col: str, value: str) -> pd.DataFrame:
+    column = data[col]
+    if value not in column.cat.categories:
+        column = column.cat.add_categories(value)
+    data[col] = column.fillna(value)
+    return data
+
+
+register_operation("compact", compact)
+register_operation("drop", _drop)
+register_operation("undersample_na", _undersample_na)
+register_operation("clip", _clip, inplace=True)
+register_operation("fill_category", _fill_category, inplace=True)
+# out-of-core frames (see `arrow_frame`) are read into memory, e.g. before training a model
+register_operation("materialize", _materialize)
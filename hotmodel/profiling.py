@@ -0,0 +1,229 @@
+"""Per-stage timing and memory instrumentation.
+
+Functions decorated with `profiled` (and blocks wrapped in `stage`) record their wall time, CPU
+time, peak memory above the memory in use when they started, and the rows they got and returned,
+but only inside a `Profile` started with `start`. Anywhere else they cost one context variable
+lookup. Profiles are bound to the current context, so concurrent app sessions do not mix their
+records:
+
+    profile = profiling.start(log_path=".cache/profiling.jsonl")
+    ...
+    profile.stop()
+    profile.to_frame()
+
+Memory is measured with `tracemalloc`, which sees Python and NumPy allocations (not the buffers
+allocated by pyarrow) and slows allocation-heavy code down, so it can be turned off with
+`trace_memory=False`. Nested stages are recorded with the name of their parent.
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+_ACTIVE: ContextVar[Optional[Profile]] = ContextVar("hotmodel_profile", default=None)
+# tracemalloc is process-wide: it runs while any profile traces memory, unless started elsewhere
+_TRACING_LOCK = threading.Lock()
+_TRACING_PROFILES = 0
+_STARTED_TRACING = False
+
+
+def _acquire_tracing():
+    global _TRACING_PROFILES, _STARTED_TRACING
+    with _TRACING_LOCK:
+        _TRACING_PROFILES += 1
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _STARTED_TRACING = True
+
+
+def _release_tracing():
+    global _TRACING_PROFILES, _STARTED_TRACING
+    with _TRACING_LOCK:
+        _TRACING_PROFILES -= 1
+        if _TRACING_PROFILES == 0 and _STARTED_TRACING:
+            tracemalloc.stop()
+            _STARTED_TRACING = False
+
+
+@dataclass
+class StageRecord:
+    stage: str
+    parent: Optional[str]
+    started_at: str
+    wall_time: float
+    cpu_time: float
+    peak_memory_delta: Optional[int]
+    rows_in: Optional[int]
+    rows_out: Optional[int]
+
+
+@dataclass
+class _OpenStage:
+    name: str
+    memory_start: int = 0
+    # highest traced memory seen by the stages nested in this one, before they reset the peak
+    peak: int = 0
+    rows_out: Optional[int] = None
+
+
+@dataclass
+class Profile:
+    trace_memory: bool = True
+    log_path: Optional[Path] = None
+    records: list[StageRecord] = field(default_factory=list)
+    _stack: list[_OpenStage] = field(default_factory=list)
+    _stopped: bool = False
+
+    def stop(self):
+        """Stop recording in the current context."""
+        if _ACTIVE.get() is self:
+            _ACTIVE.set(None)
+        if self.trace_memory and not self._stopped:
+            _release_tracing()
+        self._stopped = True
+
+    def to_frame(self) -> pd.DataFrame:
+        """One row per recorded stage, in the order they finished."""
+        columns = list(StageRecord.__dataclass_fields__)
+        records = pd.DataFrame([asdict(record) for record in self.records], columns=columns)
+        counts = ["peak_memory_delta", "rows_in", "rows_out"]
+        return records.astype({c: "Int64" for c in counts})
+
+    def summary(self) -> pd.DataFrame:
+        """Calls, total times and largest peak memory of every stage, slowest first."""
+        return (
+            self.to_frame()
+            .groupby("stage", sort=False)
+            .agg(
+                calls=("wall_time", "size"),
+                wall_time=("wall_time", "sum"),
+                cpu_time=("cpu_time", "sum"),
+                peak_memory_delta=("peak_memory_delta", "max"),
+                rows_in=("rows_in", "max"),
+            )
+            .sort_values("wall_time", ascending=False)
+        )
+
+    def _enter(self, name: str) -> _OpenStage:
+        opened = _OpenStage(name)
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                self._stack[-1].peak = max(self._stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            opened.memory_start = current
+        self._stack.append(opened)
+        return opened
+
+    def _exit(self, opened: _OpenStage, started: tuple[float, float, str], rows_in):
+        wall, cpu, started_at = started
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        self._stack.pop()
+        peak_delta = None
+        if self.trace_memory:
+            peak = max(opened.peak, tracemalloc.get_traced_memory()[1])
+            peak_delta = peak - opened.memory_start
+            if self._stack:
+                self._stack[-1].peak = max(self._stack[-1].peak, peak)
+        record = StageRecord(
+            stage=opened.name,
+            parent=self._stack[-1].name if self._stack else None,
+            started_at=started_at,
+            wall_time=wall,
+            cpu_time=cpu,
+            peak_memory_delta=peak_delta,
+            rows_in=rows_in,
+            rows_out=opened.rows_out,
+        )
+        self.records.append(record)
+        if self.log_path is not None:
+            with open(self.log_path, "a") as file:
+                file.write(json.dumps(asdict(record)) + "\n")
+
+
+def start(trace_memory: bool = True, log_path: Optional[str | Path] = None) -> Profile:
+    """Record every stage run from now on in the current context, until `Profile.stop`.
+
+    With a `log_path`, every record is also appended to that file as a JSON line. Memory peaks
+    are process-wide, so profiles running at the same time see each other's allocations. A
+    profile still active in the current context, e.g. left by an interrupted run, is stopped.
+    """
+    previous = _ACTIVE.get()
+    if previous is not None:
+        previous.stop()
+    profile = Profile(trace_memory=trace_memory)
+    if log_path is not None:
+        profile.log_path = Path(log_path)
+        profile.log_path.parent.mkdir(parents=True, exist_ok=True)
+    if trace_memory:
+        _acquire_tracing()
+    _ACTIVE.set(profile)
+    return profile
+
+
+def count_rows(value: Any) -> Optional[int]:
+    """Rows of an in-memory frame, series or array, else None.
+
+    Lazy frames are not counted, that would read them.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)) and value.ndim:
+        return value.shape[0]
+    return None
+
+
+@contextmanager
+def stage(name: str, rows: Optional[int] = None) -> Iterator[Optional[_OpenStage]]:
+    """Record the enclosed block as the stage `name`, when a profile is active.
+
+    The yielded handle (None when profiling is off) takes the rows produced as `rows_out`.
+    """
+    profile = _ACTIVE.get()
+    if profile is None:
+        yield None
+        return
+    started = (time.perf_counter(), time.process_time(), datetime.now(timezone.utc).isoformat())
+    opened = profile._enter(name)
+    try:
+        yield opened
+    finally:
+        profile._exit(opened, started, rows)
+
+
+def profiled(function: Optional[Callable] = None, *, name: Optional[str] = None):
+    """Decorator recording every call of `function` as a stage, see `stage`.
+
+    The stage is named after the qualified name of the function. Its input rows are the rows of
+    the first argument that has any, e.g. the DataFrame given to a `stats` function.
+    """
+
+    def decorator(function: Callable) -> Callable:
+        stage_name = name or f"{function.__module__.rsplit('.', 1)[-1]}.{function.__qualname__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _ACTIVE.get() is None:
+                return function(*args, **kwargs)
+            rows_in = next(
+                (n for n in map(count_rows, [*args, *kwargs.values()]) if n is not None), None
+            )
+            with stage(stage_name, rows=rows_in) as opened:
+                result = function(*args, **kwargs)
+                opened.rows_out = count_rows(result)
+            return result
+
+        return wrapper
+
+    return decorator(function) if function is not None else decorator
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import math
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+
+class QuantileSketch:
+    """Mergeable approximate quantile sketch (KLL) for data that is streamed in chunks.
+
+    Values are kept in a hierarchy of compactors where an item of level `h` stands for `2**h`
+    original values. When a level outgrows its capacity it is sorted and every other item is
+    promoted to the next level, so memory stays around `3 * k` items whatever the number of
+    values seen. The rank error of a quantile is about `1.7 / k` (k=200 -> ~0.85%).
+
+    Missing values are ignored, just like `pandas.Series.quantile` does.
+    """
+
+    def __init__(self, k: int = 200, seed: Optional[int] = 0):
+        if k < 8:
+            raise ValueError(f"k must be at least 8, got: {k}")
+        self.k = k
+        self.n = 0
+        self.levels: list[np.ndarray] = [np.empty(0, dtype=np.float64)]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values: Iterable[float]) -> QuantileSketch:
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        self.n += values.size
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other: QuantileSketch) -> QuantileSketch:
+        if other.k != self.k:
+            raise ValueError("Only sketches with the same `k` can be merged")
+        self.n += other.n
+        for h, level in enumerate(other.levels):
+            if h == len(self.levels):
+                self.levels.append(np.empty(0, dtype=np.float64))
+            self.levels[h] = np.concatenate([self.levels[h], level])
+        self._compress()
+        return self
+
+    def quantile(self, q: float | Iterable[float]) -> float | np.ndarray:
+        if self.n == 0:
+            return np.nan if np.isscalar(q) else np.full(np.shape(q), np.nan)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate(
+            [np.full(level.size, 2**h, dtype=np.float64) for h, level in enumerate(self.levels)]
+        )
+        order = np.argsort(values, kind="stable")
+        values = values[order]
+        ranks = np.cumsum(weights[order])
+
+        targets = np.asarray(q, dtype=np.float64) * ranks[-1]
+        positions = np.minimum(np.searchsorted(ranks, targets, side="left"), values.size - 1)
+        result = values[positions]
+        return float(result) if np.isscalar(q) else result
+
+    def _capacity(self, h: int) -> int:
+        depth = len(self.levels) - h - 1
+        return max(2, math.ceil(self.k * (2 / 3) ** depth))
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            level = self.levels[h]
+            if level.size >= self._capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0, dtype=np.float64))
+                level = np.sort(level)
+                # an odd item stays behind so every promoted item stands for exactly two
+                keep = level[-1:] if level.size % 2 else level[:0]
+                paired = level[: level.size - keep.size]
+                promoted = paired[self._rng.integers(2) :: 2]
+                self.levels[h] = keep.copy()
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+            h += 1
+
+
+def get_sketch_quantile_bounds(
+    chunks: Iterable[pd.DataFrame],
+    cols: list[str],
+    quantile_lower_bound: float = 0.01,
+    quantile_upper_bound: float = 0.99,
+    k: int = 200,
+) -> pd.DataFrame:
+    """Approximate lower and upper quantiles of `cols` over a stream of chunks.
+
+    The result has the same layout as `DataFrame.quantile([lower, upper])`, so it can be given
+    to `stats.multi_col_clip` as `bounds`.
+    """
+    sketches = {c: QuantileSketch(k=k) for c in cols}
+    for chunk in chunks:
+        for c in cols:
+            sketches[c].update(chunk[c].to_numpy(dtype=np.float64, na_value=np.nan))
+    q = [quantile_lower_bound, quantile_upper_bound]
+    return pd.DataFrame({c: sketches[c].quantile(q) for c in cols}, index=q)
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from hotmodel.arrow_frame import ArrowFrame
+from hotmodel.profiling import profiled
+
+
+def group_mask(data: pd.DataFrame, col: str, group: str) -> np.ndarray:
+    """Boolean mask of the rows where `col` equals `group`. Missing values never match."""
+    return data[col].eq(group).to_numpy(dtype=bool, na_value=False)
+
+
+def group_positions(data: pd.DataFrame, col: str) -> dict[object, np.ndarray]:
+    """Sorted row positions of each observed group of `col`, from a single stable argsort.
+
+    Rows where `col` is missing belong to no group.
+    """
+    codes, uniques = pd.factorize(data[col], sort=True)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+    return {uniques[i]: order[bounds[i] : bounds[i + 1]] for i in range(len(uniques))}
+
+
+@profiled
+def drop_na_in_group(data: pd.DataFrame, col: str, group: str) -> pd.DataFrame:
+    """Drop the rows of `group` that have any missing value and keep every other row.
+
+    The rows of `group` come first, followed by the remaining rows, each in their original order.
+    An `ArrowFrame` gets the same rows as a lazy filter, in dataset order.
+    """
+    if isinstance(data, ArrowFrame):
+        return data.drop_na_in_group(col, group)
+    in_group = group_mask(data, col, group)
+    complete = ~data.isna().any(axis=1).to_numpy()
+    positions = np.concatenate([np.flatnonzero(in_group & complete), np.flatnonzero(~in_group)])
+    return data.take(positions)
+
+
+def _target_sizes(
+    sizes: dict[object, int], reference: int, ratios: Optional[dict[object, float]]
+) -> dict[object, int]:
+    ratios = ratios or {}
+    unknown = set(ratios) - set(sizes)
+    if unknown:
+        raise ValueError(f"Unknown groups in the sampling ratios: {sorted(map(str, unknown))}")
+    return {g: int(round(reference * ratios.get(g, 1.0))) for g in sizes}
+
+
+@profiled
+def random_undersample(
+    data: pd.DataFrame,
+    col: str,
+    ratios: Optional[dict[object, float]] = None,
+    seed: Optional[int] = 0,
+) -> pd.DataFrame:
+    """Randomly drop rows so each group of `col` has `ratio * size of the smallest group` rows.
+
+    Groups missing from `ratios` get a ratio of 1, i.e. the default balances every group to the
+    smallest one. Groups never grow: a group smaller than its target keeps all its rows. Rows
+    keep their original order. Rows where `col` is missing belong to no group and are dropped.
+    """
+    positions = group_positions(data, col)
+    sizes = {g: len(p) for g, p in positions.items()}
+    targets = _target_sizes(sizes, min(sizes.values(), default=0), ratios)
+
+    rng = np.random.default_rng(seed)
+    kept = [
+        p if targets[g] >= len(p) else rng.choice(p, size=targets[g], replace=False)
+        for g, p in positions.items()
+    ]
+    return data.take(np.sort(np.concatenate(kept)) if kept else np.empty(0, dtype=np.int64))
+
+
+@profiled
+def random_oversample(
+    data: pd.DataFrame,
+    col: str,
+    ratios: Optional[dict[object, float]] = None,
+    seed: Optional[int] = 0,
+) -> pd.DataFrame:
+    """Stratified oversampling: every group of `col` is grown to `ratio * size of the largest
+    group` rows by drawing extra rows of that same group with replacement.
+
+    Groups missing from `ratios` get a ratio of 1, i.e. the default balances every group to the
+    largest one. Groups never shrink. The original rows come first, followed by the drawn ones.
+    Rows where `col` is missing belong to no group and are dropped.
+    """
+    positions = group_positions(data, col)
+    sizes = {g: len(p) for g, p in positions.items()}
+    targets = _target_sizes(sizes, max(sizes.values(), default=0), ratios)
+
+    rng = np.random.default_rng(seed)
+    extra = [
+        rng.choice(p, size=targets[g] - len(p), replace=True)
+        for g, p in positions.items()
+        if targets[g] > len(p)
+    ]
+    original = np.sort(np.concatenate([np.empty(0, dtype=np.int64), *positions.values()]))
+    return data.take(np.concatenate([original] + extra))
+
+
+@profiled
+def stratified_sample(
+    data: pd.DataFrame, col: str, n: int, seed: Optional[int] = 0
+) -> pd.DataFrame:
+    """Uniform random sample of about `n` rows that keeps the share of every group of `col`.
+
+    Each group is sampled without replacement in proportion to its size, so the distribution of
+    the other columns within every group is preserved. Rows keep their original order, and the
+    whole frame is returned when it has at most `n` rows. Rows where `col` is missing belong to
+    no group and are dropped.
+    """
+    if data.shape[0] <= n and not data[col].isna().any():
+        return data
+    positions = group_positions(data, col)
+    fraction = min(1.0, n / data.shape[0])
+    rng = np.random.default_rng(seed)
+    kept = [
+        rng.choice(p, size=int(round(len(p) * fraction)), replace=False) for p in positions.values()
+    ]
+    return data.take(np.sort(np.concatenate(kept)) if kept else np.empty(0, dtype=np.int64))
@@ -0,0 +1,227 @@
+"""Sequential A/B test monitor for experiment data that arrives in batches.
+
+`SequentialMonitor` keeps per variant sufficient statistics of every metric (count, mean, sum of
+squared deviations and a `QuantileSketch`), so every new batch costs O(batch) whatever the
+history. After each batch (a "look") it runs a mixture sequential probability ratio test
+(mSPRT) on the difference in means. Its p-values and confidence intervals are always valid: the
+experiment can be stopped at the first look where `p_value < alpha` without inflating the false
+positive rate, unlike repeatedly running a fixed horizon test on the growing data.
+
+The state can be saved between runs, e.g. once per day:
+
+    monitor = SequentialMonitor.load(path) if path.exists() else SequentialMonitor(["n13", "n14"])
+    monitor.update_from_chunks(DatasetLoader(path=todays_csv).iter_chunks(...))
+    monitor.save(path)
+    monitor.test()
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Iterable, Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from hotmodel.quantiles import QuantileSketch
+
+MONITOR_VERSION = 1
+
+
+class SequentialMonitor:
+    """Always-valid comparison of `treatment` against `control` on `metrics`.
+
+    The test uses a normal mixing distribution N(0, tau**2) over the true difference in means.
+    `tau` is the difference the test is tuned to detect, in metric units (a float, or a dict by
+    metric). When it is not given, it is fixed at the first look to `effect_size` times the
+    pooled standard deviation of each metric and kept for all the following looks.
+    """
+
+    def __init__(
+        self,
+        metrics: list[str],
+        group: str = "variant",
+        control: str = "A",
+        treatment: str = "B",
+        alpha: float = 0.05,
+        tau: Optional[float | dict[str, float]] = None,
+        effect_size: float = 0.1,
+        k: int = 200,
+    ):
+        self.metrics = list(metrics)
+        self.group = group
+        self.variants = [control, treatment]
+        self.alpha = alpha
+        self.effect_size = effect_size
+        self.tau2 = None
+        if tau is not None:
+            tau = [tau[m] for m in self.metrics] if isinstance(tau, dict) else [tau] * len(metrics)
+            self.tau2 = np.asarray(tau, dtype=np.float64) ** 2
+
+        shape = (len(self.variants), len(self.metrics))
+        self.n = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.sketches = {(v, m): QuantileSketch(k=k) for v in self.variants for m in self.metrics}
+
+        self.p_value = np.ones(len(self.metrics))
+        self.ci_lower = np.full(len(self.metrics), -np.inf)
+        self.ci_upper = np.full(len(self.metrics), np.inf)
+        self.looks: list[dict] = []
+
+    def update(self, batch: pd.DataFrame, look: bool = True) -> SequentialMonitor:
+        """Add the rows of `batch` to the statistics; missing values are ignored by metric.
+
+        With `look=False` the batch is only accumulated, e.g. while reading a day of data in
+        chunks, and the test is not run until the next look.
+        """
+        for v, variant in enumerate(self.variants):
+            values = batch.loc[batch[self.group] == variant, self.metrics]
+            values = values.to_numpy(dtype=np.float64, na_value=np.nan)
+            for j, m in enumerate(self.metrics):
+                self.sketches[(variant, m)].update(values[:, j])
+            self._add_moments(v, values)
+        if look:
+            self._look()
+        return self
+
+    def update_from_chunks(self, chunks: Iterable[pd.DataFrame]) -> SequentialMonitor:
+        """Accumulate every chunk and look once, so a batch read in chunks counts as one look."""
+        for chunk in chunks:
+            self.update(chunk, look=False)
+        self._look()
+        return self
+
+    def _add_moments(self, v: int, values: np.ndarray):
+        # Chan et al. pairwise update of count, mean and sum of squared deviations
+        observed = ~np.isnan(values)
+        n_b = observed.sum(axis=0).astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_b = np.where(observed, values, 0).sum(axis=0) / n_b
+            m2_b = np.where(observed, (values - mean_b) ** 2, 0).sum(axis=0)
+            n = self.n[v] + n_b
+            delta = mean_b - self.mean[v]
+            mean = self.mean[v] + delta * n_b / n
+            m2 = self.m2[v] + m2_b + delta**2 * self.n[v] * n_b / n
+        seen = n_b > 0
+        self.mean[v] = np.where(seen, mean, self.mean[v])
+        self.m2[v] = np.where(seen, m2, self.m2[v])
+        self.n[v] = n
+
+    def _statistics(self) -> dict[str, np.ndarray]:
+        n_a, n_b = self.n
+        with np.errstate(invalid="ignore", divide="ignore"):
+            var_a, var_b = self.m2[0] / (n_a - 1), self.m2[1] / (n_b - 1)
+            variance = var_a / n_a + var_b / n_b
+            diff = self.mean[1] - self.mean[0]
+            tau2 = self.tau2
+            if tau2 is None:
+                tau2 = self.effect_size**2 * (self.m2[0] + self.m2[1]) / (n_a + n_b - 2)
+            # mixture likelihood ratio of H1: diff ~ N(0, tau2) against H0: diff = 0
+            log_lr = 0.5 * np.log(variance / (variance + tau2)) + tau2 * diff**2 / (
+                2 * variance * (variance + tau2)
+            )
+            half_width = np.sqrt(
+                variance
+                * (variance + tau2)
+                / tau2
+                * (np.log((variance + tau2) / variance) - 2 * np.log(self.alpha))
+            )
+        return {
+            "diff": diff,
+            "variance": variance,
+            "tau2": tau2,
+            "log_lr": log_lr,
+            "hw": half_width,
+        }
+
+    def _look(self):
+        statistics = self._statistics()
+        valid = np.isfinite(statistics["log_lr"]) & (statistics["variance"] > 0)
+        if not valid.any():
+            return
+        if self.tau2 is None:
+            self.tau2 = statistics["tau2"]
+
+        # running minimum and intersection keep the results valid over every look so far
+        p_value = np.minimum(1.0, np.exp(-statistics["log_lr"]))
+        self.p_value = np.where(valid, np.minimum(self.p_value, p_value), self.p_value)
+        lower = statistics["diff"] - statistics["hw"]
+        upper = statistics["diff"] + statistics["hw"]
+        self.ci_lower = np.where(valid, np.maximum(self.ci_lower, lower), self.ci_lower)
+        self.ci_upper = np.where(valid, np.minimum(self.ci_upper, upper), self.ci_upper)
+
+        look = self.looks[-1]["look"] + 1 if self.looks else 0
+        for j, m in enumerate(self.metrics):
+            self.looks.append(
+                {
+                    "look": look,
+                    "metric": m,
+                    "n_control": int(self.n[0, j]),
+                    "n_treatment": int(self.n[1, j]),
+                    "diff": statistics["diff"][j],
+                    "p_value": self.p_value[j],
+                    "ci_lower": self.ci_lower[j],
+                    "ci_upper": self.ci_upper[j],
+                }
+            )
+
+    def test(self) -> pd.DataFrame:
+        """Always-valid results of the last look, one row per metric.
+
+        `decision` is "continue" until `p_value < alpha`, then the variant with the higher mean.
+        """
+        control, treatment = self.variants
+        with np.errstate(invalid="ignore", divide="ignore"):
+            diff = self.mean[1] - self.mean[0]
+            std = np.sqrt(self.m2 / (self.n - 1))
+        decision = np.where(
+            self.p_value < self.alpha, np.where(diff > 0, treatment, control), "continue"
+        )
+        return pd.DataFrame(
+            {
+                "n_control": self.n[0].astype("int64"),
+                "n_treatment": self.n[1].astype("int64"),
+                "mean_control": self.mean[0],
+                "mean_treatment": self.mean[1],
+                "std_control": std[0],
+                "std_treatment": std[1],
+                "diff": diff,
+                "ci_lower": self.ci_lower,
+                "ci_upper": self.ci_upper,
+                "p_value": self.p_value,
+                "decision": decision,
+            },
+            index=pd.Index(self.metrics, name="metric"),
+        )
+
+    def history(self) -> pd.DataFrame:
+        """Results after every look, indexed by (look, metric)."""
+        return pd.DataFrame(self.looks).set_index(["look", "metric"])
+
+    def quantiles(self, q: Iterable[float] = (0.25, 0.5, 0.75)) -> pd.DataFrame:
+        """Approximate quantiles of every metric by variant, from the quantile sketches."""
+        q = list(q)
+        return pd.DataFrame(
+            {
+                m: np.concatenate([self.sketches[(v, m)].quantile(q) for v in self.variants])
+                for m in self.metrics
+            },
+            index=pd.MultiIndex.from_product([self.variants, q], names=[self.group, "quantile"]),
+        )
+
+    def save(self, path: str | Path) -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        joblib.dump({"monitor_version": MONITOR_VERSION, "monitor": self}, tmp_path)
+        tmp_path.replace(path)
+        return path
+
+    @classmethod
+    def load(cls, path: str | Path) -> SequentialMonitor:
+        state = joblib.load(path)
+        if state.get("monitor_version") != MONITOR_VERSION:
+            raise ValueError(f"Incompatible monitor state: {path}")
+        return state["monitor"]
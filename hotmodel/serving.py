@@ -0,0 +1,274 @@
+"""Standalone HTTP scoring service for a persisted `HotModelClassifier`.
+
+Run it with `python -m hotmodel.serving --model <artifact.joblib>`. Endpoints:
+
+* `POST /predict`: a JSON row (dict) or a list of rows -> `{"variant": [...]}`
+* `GET /metrics`: request latency percentiles and batch size statistics
+* `GET /health`
+
+Concurrent requests are coalesced into micro-batches: the first waiting request opens a batch
+that is scored as soon as it holds `max_batch_size` rows or `max_latency_ms` went by.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+from hotmodel.model import HotModelClassifier
+
+Rows = list[dict[str, Any]]
+
+
+class ServingMetrics:
+    """Rolling window of request latencies and batch sizes."""
+
+    def __init__(self, window: int = 10_000):
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+
+    def record_request(self, latency: float):
+        self.requests += 1
+        self.latencies.append(latency)
+
+    def record_batch(self, size: int):
+        self.batches += 1
+        self.batch_sizes.append(size)
+
+    def report(self) -> dict[str, Any]:
+        latencies = np.asarray(self.latencies, dtype=np.float64) * 1000
+        batch_sizes = np.asarray(self.batch_sizes, dtype=np.float64)
+        report = {"requests": self.requests, "batches": self.batches, "errors": self.errors}
+        if latencies.size:
+            p50, p99 = np.percentile(latencies, [50, 99])
+            report.update(latency_p50_ms=p50, latency_p99_ms=p99)
+        if batch_sizes.size:
+            p50, p99 = np.percentile(batch_sizes, [50, 99])
+            report.update(
+                batch_size_mean=batch_sizes.mean(), batch_size_p50=p50, batch_size_p99=p99
+            )
+        return report
+
+
+class MicroBatcher:
+    """Coalesce concurrent prediction requests into batched `predict` calls."""
+
+    def __init__(
+        self,
+        predict: Callable[[Rows], Any],
+        max_batch_size: int = 256,
+        max_latency_ms: float = 5.0,
+        metrics: Optional[ServingMetrics] = None,
+    ):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.metrics = metrics or ServingMetrics()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # a single worker keeps the batches in order and the event loop free while scoring
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._executor.shutdown(wait=False)
+
+    async def submit(self, rows: Rows) -> list:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((rows, future))
+        return await future
+
+    async def _collect(self) -> list[tuple[Rows, asyncio.Future]]:
+        batch = [await self._queue.get()]
+        size = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_latency
+        while size < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            rows = [row for request_rows, _ in batch for row in request_rows]
+            self.metrics.record_batch(len(rows))
+            try:
+                result = await loop.run_in_executor(self._executor, self.predict, rows)
+            except Exception:
+                # one malformed request must not fail the others: score them one by one
+                for request_rows, future in batch:
+                    await self._score_alone(request_rows, future)
+                continue
+
+            start = 0
+            for request_rows, future in batch:
+                end = start + len(request_rows)
+                if not future.done():
+                    future.set_result(list(result[start:end]))
+                start = end
+
+    async def _score_alone(self, rows: Rows, future: asyncio.Future):
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self._executor, self.predict, rows)
+        except Exception as error:
+            if not future.done():
+                future.set_exception(error)
+        else:
+            if not future.done():
+                future.set_result(list(result))
+
+
+class ScoringServer:
+    """Minimal asyncio HTTP/1.1 server in front of a `MicroBatcher`.
+
+    Requests with rows missing any of `features` are rejected before they are queued.
+    """
+
+    def __init__(
+        self,
+        batcher: MicroBatcher,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        features: Optional[list[str]] = None,
+    ):
+        self.batcher = batcher
+        self.features = list(features or [])
+        self.host = host
+        self.port = port
+
+    async def serve_forever(self):
+        self.batcher.start()
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        async with server:
+            await server.serve_forever()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, payload = await self._route(method, target, body)
+                keep_alive = (
+                    version.strip() == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                )
+                self._write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, target: str, body: bytes) -> tuple[HTTPStatus, Any]:
+        path = target.split("?", 1)[0]
+        if method == "GET" and path == "/health":
+            return HTTPStatus.OK, {"status": "ok"}
+        if method == "GET" and path == "/metrics":
+            return HTTPStatus.OK, self.batcher.metrics.report()
+        if method != "POST" or path != "/predict":
+            return HTTPStatus.NOT_FOUND, {"error": f"Unknown endpoint: {method} {path}"}
+
+        start = time.perf_counter()
+        try:
+            rows = json.loads(body)
+            if isinstance(rows, dict):
+                rows = [rows]
+            if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+                raise ValueError("The payload must be a JSON object or a list of objects")
+        except ValueError as error:
+            self.batcher.metrics.errors += 1
+            return HTTPStatus.BAD_REQUEST, {"error": str(error)}
+
+        missing = [c for c in self.features if any(c not in row for row in rows)]
+        if missing:
+            self.batcher.metrics.errors += 1
+            return HTTPStatus.UNPROCESSABLE_ENTITY, {"error": f"Missing features: {missing}"}
+
+        try:
+            variants = await self.batcher.submit(rows)
+        except Exception as error:
+            self.batcher.metrics.errors += 1
+            return HTTPStatus.UNPROCESSABLE_ENTITY, {"error": str(error)}
+        self.batcher.metrics.record_request(time.perf_counter() - start)
+        return HTTPStatus.OK, {"variant": [str(v) for v in variants]}
+
+    @staticmethod
+    def _write_response(
+        writer: asyncio.StreamWriter, status: HTTPStatus, payload: Any, keep_alive: bool
+    ):
+        body = json.dumps(payload, default=float).encode()
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Serve variant recommendations over HTTP.")
+    parser.add_argument("--model", required=True, help="Artifact written by HotModelClassifier")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=256)
+    parser.add_argument("--max-latency-ms", type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    model = HotModelClassifier.load(args.model)
+
+    async def serve():
+        batcher = MicroBatcher(
+            model.predict, max_batch_size=args.max_batch_size, max_latency_ms=args.max_latency_ms
+        )
+        server = ScoringServer(batcher, host=args.host, port=args.port, features=model.features)
+        await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
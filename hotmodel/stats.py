@@ -1,72 +1,499 @@
 from __future__ import annotations
 
+import warnings
+from typing import Iterable
+
+import numpy as np
 import pandas as pd
 from pandas.errors import InvalidColumnName
 
+from hotmodel.arrow_frame import ArrowFrame
+from hotmodel.profiling import profiled
+from hotmodel.quantiles import QuantileSketch, get_sketch_quantile_bounds
+from hotmodel.resampling import drop_na_in_group
+
+# Every function below also accepts the `ArrowFrame` of the out-of-core backend, which it
+# consumes batch by batch with the mergeable `StreamingStats` and `QuantileSketch` instead of
+# materializing it. Counts are exact, quantiles come from a sketch (rank error ~1.7 / k).
+
 
+@profiled
 def get_stats_by_variant(data: pd.DataFrame, col: list[str]) -> pd.DataFrame:
+    if isinstance(data, ArrowFrame) and isinstance(col, list):
+        streaming = StreamingStats([col])
+        streaming.update_from_chunks(data.iter_batches(["variant"] + col))
+        return streaming.get_stats_by_variant(col)
     if isinstance(col, list):
         col = ["variant"] + col
         data = (
             data[col]
             .reset_index()
-            .groupby(col)
+            .groupby(col, observed=True)
             .agg({"index": "count"})
             .rename(columns={"index": "count"})
         )
-        data["percentage"] = round(data["count"] / data["count"].sum() * 100, 2)
-        return data
+        return _with_percentage(data)
     else:
         raise InvalidColumnName("Give a list of `valid` column names")
 
 
+def _with_percentage(data: pd.DataFrame) -> pd.DataFrame:
+    data["percentage"] = round(data["count"] / data["count"].sum() * 100, 2)
+    return data
+
+
+def _secondary_stats(primary: pd.DataFrame) -> pd.DataFrame:
+    return primary.groupby(["variant"], observed=True).agg({"count": "sum"})
+
+
+@profiled
 def get_categorical_substats_by_variant_and_column(
     data: pd.DataFrame, col: list[str]
 ) -> dict[str, pd.DataFrame]:
+    """`get_stats_by_variant` for each column in `col`, plus the totals per variant.
+
+    Instead of one groupby per column, `variant` is factorized once and every column is
+    counted with a single `np.bincount` over the combined integer codes.
+    """
+    if isinstance(data, ArrowFrame):
+        streaming = StreamingStats([[c] for c in col])
+        streaming.update_from_chunks(data.iter_batches(["variant"] + list(col)))
+        return streaming.get_categorical_substats_by_variant_and_column(col)
+    variant_codes, variants = _factorize(data["variant"])
     result = {}
     for c in col:
-        a = get_stats_by_variant(data, col=[c])
-        b = a.groupby(["variant"]).agg({"count": "sum"})
+        codes, uniques = _factorize(data[c])
+        valid = (variant_codes >= 0) & (codes >= 0)
+        counts = np.bincount(
+            variant_codes[valid] * len(uniques) + codes[valid],
+            minlength=len(variants) * len(uniques),
+        )
+        # same layout as groupby(observed=True): only observed pairs, sorted by (variant, c)
+        observed = np.flatnonzero(counts)
+        index = pd.MultiIndex.from_arrays(
+            [
+                _take_index(variants, observed // len(uniques), data["variant"]),
+                _take_index(uniques, observed % len(uniques), data[c]),
+            ],
+            names=["variant", c],
+        )
+        a = _with_percentage(pd.DataFrame({"count": counts[observed]}, index=index))
+        b = _secondary_stats(a)
 
         result[c] = {"primary": a, "secondary": b}
     return result
 
 
+def _factorize(values: pd.Series) -> tuple[np.ndarray, pd.Index]:
+    """Integer codes (-1 for missing values) and the sorted unique values they point to."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(dtype=np.int64), values.cat.categories
+    codes, uniques = pd.factorize(values, sort=True)
+    return codes.astype(np.int64, copy=False), pd.Index(uniques)
+
+
+def _take_index(uniques: pd.Index, codes: np.ndarray, values: pd.Series) -> pd.Index:
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return pd.CategoricalIndex(pd.Categorical.from_codes(codes, dtype=values.dtype))
+    taken = uniques.take(codes)
+    # groupby infers the level dtype of object keys from their values
+    return pd.Index(taken.tolist()) if taken.dtype == object else taken
+
+
+@profiled
 def get_percentage_missing_values(data: pd.DataFrame) -> pd.DataFrame:
-    temp = (
-        data.isna()
-        .sum()
-        .reset_index()
-        .rename(columns={"index": "feature_name", 0: "missing_values"})
-    )
-    temp["percentage"] = temp["missing_values"] / data.shape[0] * 100
+    if isinstance(data, ArrowFrame):
+        return _missing_values_table(*data.null_counts())
+    return _missing_values_table(data.isna().sum(), data.shape[0])
+
+
+@profiled
+def get_non_missing_counts_by_variant(data: pd.DataFrame) -> pd.DataFrame:
+    """Non missing values of every column for each variant, as `groupby("variant").count()`."""
+    if not isinstance(data, ArrowFrame):
+        return data.groupby("variant", observed=True).count()
+    counts = None
+    for chunk in data.iter_batches():
+        # categories differ from one batch to another, so partial counts are keyed by values
+        chunk["variant"] = chunk["variant"].astype(object)
+        partial = chunk.groupby("variant").count()
+        if counts is not None:
+            partial = counts.add(partial, fill_value=0).astype(partial.dtypes)
+        counts = partial
+    if counts is None:
+        return data.head(0).groupby("variant", observed=True).count()
+    counts = counts.sort_index()
+    counts.index = pd.CategoricalIndex(counts.index, name="variant")
+    return counts
+
+
+def _missing_values_table(missing: pd.Series, n_rows: int) -> pd.DataFrame:
+    temp = missing.reset_index().rename(columns={"index": "feature_name", 0: "missing_values"})
+    temp["percentage"] = temp["missing_values"] / n_rows * 100
     return temp
 
 
+class StreamingStats:
+    """Incremental version of the variant statistics for data that does not fit in memory.
+
+    Each chunk only updates mergeable partial counts (group counts per column list and missing
+    value tallies), and the tables built from them are identical to the ones returned by
+    `get_stats_by_variant`, `get_categorical_substats_by_variant_and_column` and
+    `get_percentage_missing_values` over the whole data.
+
+    `groupings` holds every column list that will be asked to `get_stats_by_variant`; single
+    columns given to `get_categorical_substats_by_variant_and_column` are tracked as `[c]`.
+    """
+
+    def __init__(self, groupings: list[list[str]]):
+        for col in groupings:
+            if not isinstance(col, list):
+                raise InvalidColumnName("Give a list of `valid` column names")
+        self.groupings = [["variant"] + col for col in groupings]
+        self.n_rows = 0
+        self.missing: pd.Series | None = None
+        self.counts: dict[tuple[str, ...], pd.Series] = {}
+        self.dtypes: dict[str, object] = {}
+
+    def update(self, chunk: pd.DataFrame) -> StreamingStats:
+        self.n_rows += chunk.shape[0]
+        missing = chunk.isna().sum()
+        self.missing = missing if self.missing is None else self.missing + missing
+
+        for col in self.groupings:
+            self._update_dtypes(chunk, col)
+            counts = chunk.groupby(col, observed=True).size()
+            # categories differ from one chunk to another, so partial counts are keyed by values
+            counts.index = counts.index.set_levels(
+                [level.astype(object) for level in counts.index.levels],
+                level=list(range(len(col))),
+            )
+            self._add_counts(tuple(col), counts)
+        return self
+
+    def merge(self, other: StreamingStats) -> StreamingStats:
+        """Merge the partial counts of another instance, e.g. one that ran on other chunks."""
+        if other.groupings != self.groupings:
+            raise ValueError("Only instances tracking the same groupings can be merged")
+        self.n_rows += other.n_rows
+        if other.missing is not None:
+            self.missing = other.missing if self.missing is None else self.missing + other.missing
+        for key, counts in other.counts.items():
+            self._add_counts(key, counts)
+        for c, dtype in other.dtypes.items():
+            self._merge_dtype(c, dtype)
+        return self
+
+    def update_from_chunks(self, chunks: Iterable[pd.DataFrame]) -> StreamingStats:
+        for chunk in chunks:
+            self.update(chunk)
+        return self
+
+    def get_stats_by_variant(self, col: list[str]) -> pd.DataFrame:
+        if not isinstance(col, list):
+            raise InvalidColumnName("Give a list of `valid` column names")
+        key = tuple(["variant"] + col)
+        if key not in self.counts:
+            raise InvalidColumnName(f"The columns {col} are not tracked by this instance")
+
+        counts = self.counts[key].sort_index()
+        index = pd.MultiIndex.from_arrays(
+            [self._restore_dtype(c, counts.index.get_level_values(c)) for c in key],
+            names=list(key),
+        )
+        data = pd.DataFrame({"count": counts.to_numpy()}, index=index)
+        return _with_percentage(data)
+
+    def get_categorical_substats_by_variant_and_column(
+        self, col: list[str]
+    ) -> dict[str, pd.DataFrame]:
+        result = {}
+        for c in col:
+            a = self.get_stats_by_variant(col=[c])
+            b = _secondary_stats(a)
+
+            result[c] = {"primary": a, "secondary": b}
+        return result
+
+    def get_percentage_missing_values(self) -> pd.DataFrame:
+        if self.missing is None:
+            raise ValueError("No chunk was processed yet")
+        return _missing_values_table(self.missing, self.n_rows)
+
+    def _add_counts(self, key: tuple[str, ...], counts: pd.Series):
+        if key in self.counts:
+            counts = self.counts[key].add(counts, fill_value=0).astype("int64")
+        self.counts[key] = counts
+
+    def _update_dtypes(self, chunk: pd.DataFrame, col: list[str]):
+        for c in col:
+            self._merge_dtype(c, chunk[c].dtype)
+
+    def _merge_dtype(self, c: str, dtype):
+        current = self.dtypes.get(c)
+        if isinstance(dtype, pd.CategoricalDtype) and isinstance(current, pd.CategoricalDtype):
+            # same as loading the whole data at once: categories are every value seen, sorted
+            dtype = pd.CategoricalDtype(current.categories.union(dtype.categories))
+        elif current is not None and current != dtype:
+            # untyped chunks can infer different dtypes, e.g. float for an all-missing chunk
+            both_numpy = isinstance(current, np.dtype) and isinstance(dtype, np.dtype)
+            dtype = np.result_type(current, dtype) if both_numpy else np.dtype(object)
+        self.dtypes[c] = dtype
+
+    def _restore_dtype(self, c: str, values: pd.Index) -> pd.Index:
+        dtype = self.dtypes[c]
+        if isinstance(dtype, pd.CategoricalDtype):
+            return pd.CategoricalIndex(values, dtype=dtype, name=c)
+        if dtype == object:
+            # groupby infers the level dtype of object keys from their values, so does this
+            return pd.Index(values.tolist(), name=c)
+        return values.astype(dtype)
+
+
+@profiled
 def undersample_col_with_na_with_categorical_group(
     data: pd.DataFrame, col: str, group: str
 ) -> pd.DataFrame:
-    temp_a = data[data[col] == group].dropna(axis=0, how="any")
-    temp_b = data[data[col] != group]
-    temp = data.loc[list(temp_a.index) + list(temp_b.index), :]
-    return temp
+    return drop_na_in_group(data, col=col, group=group)
 
 
+@profiled
+def get_quantile_bounds(
+    data: pd.DataFrame,
+    cols: list[str],
+    quantile_lower_bound: float = 0.01,
+    quantile_upper_bound: float = 0.99,
+) -> pd.DataFrame:
+    """Lower and upper quantiles of every column in a single vectorized pass."""
+    if isinstance(data, ArrowFrame):
+        return get_sketch_quantile_bounds(
+            data.iter_batches(cols), cols, quantile_lower_bound, quantile_upper_bound
+        )
+    return data[cols].quantile([quantile_lower_bound, quantile_upper_bound])
+
+
+@profiled
+def get_mean_and_percentile_interval(
+    data: pd.DataFrame, group: str, cols: list[str], width: float = 95
+) -> pd.DataFrame:
+    """Mean and central `width`% percentile interval of `cols` for every group.
+
+    The same bars as seaborn `barplot(errorbar=("pi", width))`, aggregated in a single groupby:
+    one row per group, with the `mean`, `lower` and `upper` of every column as a column
+    MultiIndex.
+    """
+    grouped = data.groupby(group, observed=True)[cols]
+    q = [(100 - width) / 200, (100 + width) / 200]
+    bounds = grouped.quantile(q).unstack()
+    bounds.columns = bounds.columns.set_levels(["lower", "upper"], level=1)
+    mean = grouped.mean()
+    mean.columns = pd.MultiIndex.from_product([cols, ["mean"]])
+    return pd.concat([mean, bounds], axis=1)[
+        pd.MultiIndex.from_product([cols, ["mean", "lower", "upper"]])
+    ]
+
+
+@profiled
+def get_boxplot_summary(
+    data: pd.DataFrame,
+    cols: list[str],
+    quantiles: Iterable[float] = (0.05, 0.95),
+    whis: float = 1.5,
+    max_fliers: int = 1000,
+    seed: int | None = 0,
+) -> pd.DataFrame:
+    """Box-and-whiskers statistics of every column, as `matplotlib.cbook.boxplot_stats` does.
+
+    One row per column with its `n`, `mean`, quartiles (`q1`, `med`, `q3`), notch interval
+    (`cilo`, `cihi`), whiskers (`whislo`, `whishi`, the most extreme values within `whis` times
+    the IQR) and outlier count, plus the extra `quantiles` as float labelled columns. `fliers`
+    holds at most `max_fliers` of the outliers: both extremes and a random sample of the others.
+    Missing values are ignored. All quantiles come from a single sort of every column.
+    """
+    quantiles = list(quantiles)
+    if isinstance(data, ArrowFrame):
+        return _streaming_boxplot_summary(data, cols, quantiles, whis, max_fliers, seed)
+    values = data[cols].to_numpy(dtype=np.float64, na_value=np.nan)
+    n = (~np.isnan(values)).sum(axis=0)
+    with np.errstate(invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        q = np.nanquantile(values, [0.25, 0.5, 0.75] + quantiles, axis=0)
+        mean = np.nanmean(values, axis=0)
+    q1, med, q3 = q[:3]
+    iqr = q3 - q1
+    low, high = q1 - whis * iqr, q3 + whis * iqr
+    # comparisons with NaN are False, so missing values never count as whiskers or outliers
+    whislo = np.where(values >= low, values, np.inf).min(axis=0)
+    whishi = np.where(values <= high, values, -np.inf).max(axis=0)
+    outliers = (values < whislo) | (values > whishi)
+
+    rng = np.random.default_rng(seed)
+    fliers = []
+    for j in range(len(cols)):
+        column = values[outliers[:, j], j]
+        if column.size > max_fliers:
+            extremes = [column.argmin(), column.argmax()]
+            sample = rng.choice(column.size, size=max_fliers - 2, replace=False)
+            column = column[np.unique(np.concatenate([extremes, sample]))]
+        fliers.append(column)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        notch = 1.57 * iqr / np.sqrt(n)
+    summary = pd.DataFrame(
+        {
+            "n": n,
+            "mean": mean,
+            "q1": q1,
+            "med": med,
+            "q3": q3,
+            "cilo": med - notch,
+            "cihi": med + notch,
+            "whislo": np.where(n > 0, whislo, np.nan),
+            "whishi": np.where(n > 0, whishi, np.nan),
+            "n_fliers": outliers.sum(axis=0),
+            "fliers": fliers,
+        },
+        index=pd.Index(cols),
+    )
+    for i, quantile in enumerate(quantiles):
+        summary[quantile] = q[3 + i]
+    return summary
+
+
+def _streaming_boxplot_summary(
+    data: ArrowFrame,
+    cols: list[str],
+    quantiles: list[float],
+    whis: float,
+    max_fliers: int,
+    seed: int | None,
+) -> pd.DataFrame:
+    """`get_boxplot_summary` in two passes over the batches of `data`.
+
+    The first pass sketches the quantiles and sums the values, the second one finds the
+    whiskers and keeps the outliers with the `max_fliers - 2` smallest random keys plus both
+    extremes, a uniform sample of them however the rows are split into batches.
+    """
+    sketches = [QuantileSketch() for _ in cols]
+    n = np.zeros(len(cols), dtype=np.int64)
+    total = np.zeros(len(cols))
+    for chunk in data.iter_batches(cols):
+        values = chunk.to_numpy(dtype=np.float64, na_value=np.nan)
+        for j, sketch in enumerate(sketches):
+            sketch.update(values[:, j])
+        n += (~np.isnan(values)).sum(axis=0)
+        total += np.nansum(values, axis=0)
+    q = np.array([s.quantile([0.25, 0.5, 0.75] + quantiles) for s in sketches]).T
+    q1, med, q3 = q[:3]
+    iqr = q3 - q1
+    low, high = q1 - whis * iqr, q3 + whis * iqr
+
+    # whislo is the smallest value >= low, so the outliers are exactly the values outside
+    # [low, high]: they are counted and sampled in the same pass as the whiskers
+    rng = np.random.default_rng(seed)
+    whislo = np.full(len(cols), np.inf)
+    whishi = np.full(len(cols), -np.inf)
+    n_fliers = np.zeros(len(cols), dtype=np.int64)
+    kept = [(np.empty(0), np.empty(0)) for _ in cols]
+    extremes = [np.array([np.inf, -np.inf]) for _ in cols]
+    for chunk in data.iter_batches(cols):
+        values = chunk.to_numpy(dtype=np.float64, na_value=np.nan)
+        whislo = np.minimum(whislo, np.where(values >= low, values, np.inf).min(axis=0))
+        whishi = np.maximum(whishi, np.where(values <= high, values, -np.inf).max(axis=0))
+        outliers = (values < low) | (values > high)
+        n_fliers += outliers.sum(axis=0)
+        for j in range(len(cols)):
+            column = values[outliers[:, j], j]
+            if not column.size:
+                continue
+            lowest, highest = extremes[j]
+            extremes[j] = np.array([min(lowest, column.min()), max(highest, column.max())])
+            keys = np.concatenate([kept[j][0], rng.random(column.size)])
+            column = np.concatenate([kept[j][1], column])
+            if column.size > max_fliers:
+                smallest = np.argpartition(keys, max_fliers)[:max_fliers]
+                keys, column = keys[smallest], column[smallest]
+            kept[j] = (keys, column)
+
+    fliers = []
+    for j in range(len(cols)):
+        keys, column = kept[j]
+        if n_fliers[j] > max_fliers:
+            column = np.concatenate([column[np.argsort(keys)][: max_fliers - 2], extremes[j]])
+        fliers.append(np.sort(column))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / n
+        notch = 1.57 * iqr / np.sqrt(n)
+    summary = pd.DataFrame(
+        {
+            "n": n,
+            "mean": np.where(n > 0, mean, np.nan),
+            "q1": q1,
+            "med": med,
+            "q3": q3,
+            "cilo": med - notch,
+            "cihi": med + notch,
+            "whislo": np.where(n > 0, whislo, np.nan),
+            "whishi": np.where(n > 0, whishi, np.nan),
+            "n_fliers": n_fliers,
+            "fliers": fliers,
+        },
+        index=pd.Index(cols),
+    )
+    for i, quantile in enumerate(quantiles):
+        summary[quantile] = q[3 + i]
+    return summary
+
+
+@profiled
 def multi_col_clip(
     data: pd.DataFrame,
     cols: list[str],
     quantile_lower_bound: float = 0.01,
     quantile_upper_bound: float = 0.99,
+    method: str = "exact",
+    inplace: bool = False,
+    bounds: pd.DataFrame | None = None,
+    k: int = 200,
 ):
-    data = data.copy(deep=True)
+    """Clip `cols` to their lower and upper quantiles.
+
+    `method="exact"` computes every bound with one `DataFrame.quantile` call, while
+    `method="sketch"` uses a mergeable `QuantileSketch` with a rank error of about `1.7 / k`.
+    Precomputed `bounds` (e.g. from `quantiles.get_sketch_quantile_bounds` over chunks) skip the
+    quantile computation altogether. With `inplace=True` the given frame is clipped and returned
+    instead of a deep copy of it.
+
+    An `ArrowFrame` always gets sketched bounds and is returned as a new lazy view with the
+    clipping recorded as a projection, whatever `inplace` is.
+    """
+    if bounds is None:
+        if method == "exact":
+            bounds = get_quantile_bounds(data, cols, quantile_lower_bound, quantile_upper_bound)
+        elif method == "sketch":
+            chunks = data.iter_batches(cols) if isinstance(data, ArrowFrame) else [data]
+            bounds = get_sketch_quantile_bounds(
+                chunks, cols, quantile_lower_bound, quantile_upper_bound, k=k
+            )
+        else:
+            raise ValueError(f"method must be either 'exact' or 'sketch', got: {method}")
+
+    clip_bounds = {}
     for c in cols:
-        min_bound = data[c].quantile(quantile_lower_bound)
-        max_bound = data[c].quantile(quantile_upper_bound)
+        min_bound, max_bound = bounds[c].iloc[0], bounds[c].iloc[1]
 
         # This is a limit that allow us to better visualize samples.
         # The table makes any number greather than 2**53 as `inf`.
         # if making matricial operations on this number, everything will be `inf`
         max_bound = max_bound if max_bound < 2**53 else 2**52
 
+        clip_bounds[c] = (min_bound, max_bound)
+
+    if isinstance(data, ArrowFrame):
+        return data.clip(clip_bounds)
+    if not inplace:
+        data = data.copy(deep=True)
+    for c, (min_bound, max_bound) in clip_bounds.items():
         data[c] = data[c].clip(min_bound, max_bound)
     return data
@@ -0,0 +1,115 @@
+"""Synthetic experiment data with the schema of the real dataset, at any size.
+
+Every column of the documented schema is generated with vectorized draws: skewed categorical
+features `c1` to `c6` (`c1` and `c6` with many categories), a sparse boolean `c5`, the variant
+(about 60% of the users in *A*), heavy tailed numerical features `n1` to `n12`, with `n6` and
+`n10` around 1e8 and a tail past 1e10, and `n9` 95% missing, and the experiment metrics: `n13`,
+the engagement during the test, follows `n1`, and `n14`, the revenue, follows `n13`, both a bit
+higher in variant *B*. Missing values follow the real data too: `c1`, `c2`, `c4` and `c6` miss
+about 10% of their values in variant *A*, while in variant *B* only `c2` does.
+
+Large files are written in chunks with `write_csv`, so the generator never holds more than one
+chunk in memory.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:  # pragma: no cover
+    pa = None
+
+COLUMNS = ["id", "c1", "c2", "c3", "c4", "c5", "c6", "variant"] + [f"n{i}" for i in range(1, 15)]
+CARDINALITIES = {"c1": 200, "c2": 6, "c3": 60, "c4": 40, "c6": 40}
+# share of missing values of each column, in variant A and B
+MISSING = {"c1": (0.1, 0.0), "c2": (0.1, 0.1), "c4": (0.1, 0.0), "c6": (0.1, 0.0)}
+VARIANT_A_SHARE = 0.6
+C5_SHARE = 0.01
+N9_MISSING = 0.95
+LARGE_FEATURES = ("n6", "n10")
+
+
+def _categories(col: str, cardinality: int) -> np.ndarray:
+    return np.array([f"v{col}{i}" for i in range(cardinality)], dtype=object)
+
+
+def generate(n_rows: int, seed: Optional[int] = 0, start_id: int = 0) -> pd.DataFrame:
+    """`n_rows` users with the columns of the experiment CSV file, in its column order."""
+    rng = np.random.default_rng(seed)
+    data = {"id": np.arange(start_id, start_id + n_rows)}
+    in_b = rng.random(n_rows) >= VARIANT_A_SHARE
+
+    for col, cardinality in CARDINALITIES.items():
+        # Zipf-like frequencies: a few common categories and a long tail of rare ones
+        weights = 1 / np.arange(1, cardinality + 1)
+        codes = rng.choice(cardinality, size=n_rows, p=weights / weights.sum())
+        values = _categories(col, cardinality)[codes]
+        share_a, share_b = MISSING.get(col, (0.0, 0.0))
+        values[rng.random(n_rows) < np.where(in_b, share_b, share_a)] = None
+        data[col] = values
+
+    # c5 is only ever set, to True, for a few users of variant B
+    data["c5"] = np.where(
+        in_b & (rng.random(n_rows) < C5_SHARE / (1 - VARIANT_A_SHARE)), True, None
+    )
+    data["variant"] = np.where(in_b, "B", "A").astype(object)
+
+    for i in range(1, 13):
+        sigma = rng.uniform(1.0, 2.0)
+        values = rng.lognormal(mean=0.0, sigma=sigma, size=n_rows)
+        if f"n{i}" in LARGE_FEATURES:
+            values *= 1e8
+        data[f"n{i}"] = values
+    data["n9"][rng.random(n_rows) < N9_MISSING] = np.nan
+
+    uplift = np.where(in_b, 1.1, 1.0)
+    data["n13"] = data["n1"] * (7 / 30) * uplift * rng.lognormal(0.0, 0.5, size=n_rows)
+    data["n14"] = 0.05 * data["n13"] * uplift * rng.lognormal(0.0, 1.0, size=n_rows)
+    return pd.DataFrame(data, columns=COLUMNS)
+
+
+def write_csv(
+    path: str | Path, n_rows: int, seed: Optional[int] = 0, chunksize: int = 1_000_000
+) -> Path:
+    """Write `n_rows` synthetic users to a CSV file, generating `chunksize` rows at a time.
+
+    Every chunk gets its own independent random stream, so the same `seed` and `chunksize`
+    always write the same file. The pyarrow CSV writer is used when available, it is an order
+    of magnitude faster than `DataFrame.to_csv`.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    n_chunks = max(1, -(-n_rows // chunksize))
+    seeds = np.random.SeedSequence(seed).spawn(n_chunks)
+    chunks = (
+        generate(min(chunksize, n_rows - i * chunksize), seed=chunk_seed, start_id=i * chunksize)
+        for i, chunk_seed in enumerate(seeds)
+    )
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    if pa is not None:
+        _write_csv_arrow(chunks, tmp_path)
+    else:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(tmp_path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+    tmp_path.replace(path)
+    return path
+
+
+def _write_csv_arrow(chunks, path: Path):
+    # explicit types: a chunk without any c5 would otherwise infer a different schema
+    schema = pa.schema(
+        [("id", pa.int64())]
+        + [(c, pa.bool_() if c == "c5" else pa.string()) for c in COLUMNS[1:8]]
+        + [(c, pa.float64()) for c in COLUMNS[8:]]
+    )
+    options = pacsv.WriteOptions(quoting_style="needed")
+    with pacsv.CSVWriter(path, schema, write_options=options) as writer:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
@@ -0,0 +1,221 @@
+"""Hyperparameter search for `HotModelClassifier`.
+
+The search space lives next to the hyperparameters, in `input/model_config/search_space.json`.
+Candidates are evaluated with successive halving, or Hyperband (several successive halving
+brackets), using the number of trees as the budget: every rung trains the surviving candidates
+with `eta` times more trees and only keeps the best `1 / eta` of them, so poor candidates are
+stopped early. Run it with:
+
+    python -m hotmodel.tuning --data input/data/data.csv \
+        --search-space input/model_config/search_space.json \
+        --output input/model_config/hyperparameter.tuned.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import math
+import tempfile
+from pathlib import Path
+from typing import Any, Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import StratifiedKFold
+
+from hotmodel.data_loader import DatasetLoader
+from hotmodel.model import HotModelClassifier
+
+OBJECTIVES = ("oob", "cv")
+STRATEGIES = ("hyperband", "successive_halving")
+
+
+def _evaluate(
+    X: np.ndarray,
+    y: np.ndarray,
+    params: dict[str, Any],
+    objective: str,
+    cv_folds: int,
+    seed: Optional[int],
+) -> float:
+    if objective == "oob":
+        model = RandomForestClassifier(**{**params, "oob_score": True, "random_state": seed})
+        return float(model.fit(X, y).oob_score_)
+
+    params = {**params, "oob_score": False, "random_state": seed}
+    folds = StratifiedKFold(n_splits=cv_folds, shuffle=True, random_state=seed)
+    scores = [
+        RandomForestClassifier(**params).fit(X[train], y[train]).score(X[test], y[test])
+        for train, test in folds.split(np.zeros(len(y)), y)
+    ]
+    return float(np.mean(scores))
+
+
+class HyperparameterSearch:
+    """Successive halving / Hyperband search over `RandomForestClassifier` hyperparameters.
+
+    The data goes through the `HotModelClassifier` preprocessing pipeline once; the resulting
+    float32 feature matrix is shared with the worker processes as a memory-mapped file and
+    reused by every candidate.
+    """
+
+    def __init__(self, data: pd.DataFrame, search_space: dict[str, Any], n_jobs: int = -1):
+        self.search_space = search_space
+        self.n_jobs = n_jobs
+        self.objective = search_space.get("objective", "oob")
+        self.strategy = search_space.get("strategy", "hyperband")
+        if self.objective not in OBJECTIVES:
+            raise ValueError(f"objective must be one of {OBJECTIVES}, got: {self.objective}")
+        if self.strategy not in STRATEGIES:
+            raise ValueError(f"strategy must be one of {STRATEGIES}, got: {self.strategy}")
+        self.resource = search_space.get("resource", "n_estimators")
+        self.min_resource = int(search_space["min_resource"])
+        self.max_resource = int(search_space["max_resource"])
+        self.eta = int(search_space.get("eta", 3))
+        self.cv_folds = int(search_space.get("cv_folds", 3))
+        self.seed = search_space.get("seed")
+        self.fixed = search_space.get("fixed", {})
+        self.space = search_space["space"]
+        self.X, self.y = self._preprocess(data)
+
+        self.history: Optional[pd.DataFrame] = None
+        self.best_params_: Optional[dict[str, Any]] = None
+        self.best_score_: Optional[float] = None
+
+    @classmethod
+    def from_json(cls, data: pd.DataFrame, path: str | Path, n_jobs: int = -1):
+        with open(path) as file:
+            return cls(data, json.load(file), n_jobs=n_jobs)
+
+    def _preprocess(self, data: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+        features = self.search_space["features"]
+        model = HotModelClassifier(data=data, features=features, hyperparameters=self.fixed)
+        transformed = model.pipeline_builder(
+            ordinal_features=self.search_space.get("ordinal_features", []), one_hot_features=None
+        )
+        X = transformed[features].to_numpy(dtype=np.float32, na_value=np.nan)
+        y = pd.factorize(data[self.search_space.get("target", "variant")], sort=True)[0]
+        return X, y
+
+    def candidates(self, n: Optional[int] = None, rng=None) -> list[dict[str, Any]]:
+        """Every combination of the space, or `n` of them drawn without replacement."""
+        names = list(self.space)
+        grid = [dict(zip(names, values)) for values in itertools.product(*self.space.values())]
+        if n is None or n >= len(grid):
+            return grid
+        rng = rng or np.random.default_rng(self.seed)
+        return [grid[i] for i in rng.choice(len(grid), size=n, replace=False)]
+
+    def _evaluate_rung(self, X, y, candidates: list[dict[str, Any]], resource: int) -> list[float]:
+        return joblib.Parallel(n_jobs=self.n_jobs)(
+            joblib.delayed(_evaluate)(
+                X,
+                y,
+                {**self.fixed, **params, self.resource: resource},
+                self.objective,
+                self.cv_folds,
+                self.seed,
+            )
+            for params in candidates
+        )
+
+    def _successive_halving(
+        self, X, y, candidates: list[dict[str, Any]], resource: int, bracket: int
+    ) -> list[dict[str, Any]]:
+        history = []
+        rung = 0
+        while True:
+            scores = self._evaluate_rung(X, y, candidates, resource)
+            history += [
+                {"bracket": bracket, "rung": rung, self.resource: resource, "score": score, **p}
+                for p, score in zip(candidates, scores)
+            ]
+            if resource >= self.max_resource:
+                return history
+            # the last survivor is still promoted, to compete with the full budget
+            keep = max(1, len(candidates) // self.eta)
+            order = np.argsort(scores, kind="stable")[::-1][:keep]
+            candidates = [candidates[i] for i in order]
+            resource = min(resource * self.eta, self.max_resource)
+            rung += 1
+
+    def run(self) -> pd.DataFrame:
+        """Run the search and return every evaluation, one row per candidate and rung."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "features.joblib"
+            joblib.dump((self.X, self.y), path)
+            X, y = joblib.load(path, mmap_mode="r")
+
+            if self.strategy == "successive_halving":
+                n = self.search_space.get("n_candidates")
+                history = self._successive_halving(X, y, self.candidates(n), self.min_resource, 0)
+            else:
+                history = []
+                rng = np.random.default_rng(self.seed)
+                s_max = int(math.log(self.max_resource / self.min_resource, self.eta) + 1e-9)
+                for s in range(s_max, -1, -1):
+                    n = math.ceil((s_max + 1) / (s + 1) * self.eta**s)
+                    resource = max(self.min_resource, round(self.max_resource / self.eta**s))
+                    history += self._successive_halving(
+                        X, y, self.candidates(n, rng), resource, bracket=s_max - s
+                    )
+
+        self.history = pd.DataFrame(history)
+        # only candidates that went through the whole budget compete for the best score
+        best = max(
+            (record for record in history if record[self.resource] == self.max_resource),
+            key=lambda record: record["score"],
+        )
+        self.best_score_ = float(best["score"])
+        self.best_params_ = {
+            **self.fixed,
+            **{k: _to_json(best[k]) for k in self.space},
+            self.resource: int(best[self.resource]),
+        }
+        return self.history
+
+    def write_best(self, path: str | Path) -> Path:
+        if self.best_params_ is None:
+            raise ValueError("Call `run` before writing the best hyperparameters")
+        path = Path(path)
+        with open(path, "w") as file:
+            json.dump(self.best_params_, file, indent=4)
+            file.write("\n")
+        return path
+
+
+def _to_json(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Tune the HotModelClassifier hyperparameters.")
+    parser.add_argument("--data", required=True, help="CSV file with the experiment data")
+    parser.add_argument("--search-space", default="input/model_config/search_space.json")
+    parser.add_argument("--output", default="input/model_config/hyperparameter.tuned.json")
+    parser.add_argument("--n-jobs", type=int, default=-1)
+    args = parser.parse_args(argv)
+
+    with open(args.search_space) as file:
+        search_space = json.load(file)
+    ordinal_features = search_space.get("ordinal_features", [])
+    target = search_space.get("target", "variant")
+    dataloader = DatasetLoader(path=args.data)
+    dataloader.load_data(
+        categorical_columns=ordinal_features + [target],
+        numerical_columns=[c for c in search_space["features"] if c not in ordinal_features],
+    )
+
+    search = HyperparameterSearch(dataloader.data, search_space, n_jobs=args.n_jobs)
+    history = search.run()
+    print(history.sort_values("score", ascending=False).head(10).to_string())
+    print(f"Best score: {search.best_score_:.4f} with {search.best_params_}")
+    print(f"Written to {search.write_best(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
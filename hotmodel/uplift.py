@@ -0,0 +1,273 @@
+"""Variant recommendation from the uplift of every variant on revenue and engagement.
+
+`UpliftRecommender` learns, from the experiment data, what each user would bring under every
+variant: the revenue (`n14`) and the engagement during the test (`n13`). Then it recommends, for
+every user, the variant with the highest expected revenue among those that do not lose more
+engagement than `max_engagement_loss` compared to the control variant.
+
+Two meta-learners are available, both built on multi-output random forests predicting the two
+outcomes at once:
+
+* `"t"` (T-learner): one forest per variant, fitted on the users who saw it;
+* `"x"` (X-learner): the T-learner forests impute the effect of every treatment for the users of
+  both groups, and a second pair of forests learns it from each group. Their predictions are
+  averaged with the share of treated users as weight, the propensity of a randomized
+  experiment. This helps when the groups are unbalanced, as after the undersampling of *A*.
+
+Either way, the outcome of every variant is a weighted sum of tree predictions, so a batch is
+scored under all the variants at once: it is encoded a single time and every tree is evaluated
+once on it, whatever the number of variants.
+
+Fitting takes several forests, so `fit_or_load` saves the fitted recommender and loads it back as
+long as the data and the parameters do not change, as `HotModelClassifier.fit_or_load` does.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OrdinalEncoder
+
+from hotmodel.inference import CompiledEncoder, Payload
+from hotmodel.profiling import profiled
+
+LEARNERS = ("t", "x")
+HYPERPARAMETERS = {"n_estimators": 50, "min_samples_leaf": 50, "max_features": 0.5, "n_jobs": -1}
+# bump whenever the content of the saved artifact changes
+ARTIFACT_VERSION = 1
+
+
+class UpliftRecommender:
+    """Recommends the variant that maximizes `revenue` without losing `engagement`.
+
+    `features` must be known before the experiment (not `n13` or `n14`), `ordinal_features` are
+    the categorical ones among them. The engagement of a variant is allowed to be at most
+    `max_engagement_loss` (a fraction) lower than the engagement under `control`, e.g. 0.05
+    trades up to 5% of engagement for revenue.
+    """
+
+    def __init__(
+        self,
+        features: list[str],
+        ordinal_features: list[str],
+        hyperparameters: Optional[dict[str, Any]] = None,
+        learner: str = "x",
+        revenue: str = "n14",
+        engagement: str = "n13",
+        group: str = "variant",
+        control: str = "A",
+        max_engagement_loss: float = 0.0,
+    ):
+        if learner not in LEARNERS:
+            raise ValueError(f"learner must be one of {LEARNERS}, got: {learner}")
+        self.features = list(features)
+        self.ordinal_features = list(ordinal_features)
+        self.hyperparameters = hyperparameters if hyperparameters is not None else HYPERPARAMETERS
+        self.learner = learner
+        self.outcomes = [revenue, engagement]
+        self.group = group
+        self.control = control
+        self.max_engagement_loss = max_engagement_loss
+
+    @profiled
+    def fit(self, data: pd.DataFrame) -> UpliftRecommender:
+        """Fit the forests of the meta-learner on the experiment `data`, one row per user.
+
+        Rows missing their variant or an outcome are left out.
+        """
+        data = data.dropna(subset=[self.group] + self.outcomes)
+        variants = sorted(data[self.group].unique())
+        if self.control not in variants:
+            raise ValueError(f"Control variant `{self.control}` is not in the data")
+        self.variants = np.array(
+            [self.control] + [v for v in variants if v != self.control], dtype=object
+        )
+
+        encoder = OrdinalEncoder(
+            encoded_missing_value=-1,
+            unknown_value=-1,
+            min_frequency=100,
+            handle_unknown="use_encoded_value",
+        )
+        pipeline = Pipeline(
+            [
+                (
+                    "column_transformer",
+                    ColumnTransformer([("ordinal_encoder", encoder, self.ordinal_features)]),
+                )
+            ]
+        )
+        self.encoder = CompiledEncoder(pipeline.fit(data), self.features)
+        X = self.encoder.encode(data)
+        Y = data[self.outcomes].to_numpy(dtype=np.float64)
+        # both outcomes weigh the same in the splits of the multi-output trees
+        self.scale = Y.std(axis=0)
+        self.scale[self.scale == 0] = 1.0
+        Y = Y / self.scale
+        groups = data[self.group].to_numpy()
+        masks = [groups == v for v in self.variants]
+
+        slots = np.eye(len(self.variants))
+        outcome_forests = [self._fit_forest(X[mask], Y[mask]) for mask in masks]
+        # every forest, with the weight of its trees in the outcome of each variant
+        if self.learner == "t":
+            forests = list(zip(outcome_forests, slots))
+        else:
+            control, control_mask = outcome_forests[0], masks[0]
+            forests = [(control, np.ones(len(self.variants)))]
+            for v in range(1, len(self.variants)):
+                treated, treated_mask = outcome_forests[v], masks[v]
+                # imputed effects: observed minus counterfactual outcomes, in each group
+                effect_treated = Y[treated_mask] - control.predict(X[treated_mask])
+                effect_control = treated.predict(X[control_mask]) - Y[control_mask]
+                propensity = treated_mask.sum() / (treated_mask.sum() + control_mask.sum())
+                forests += [
+                    (self._fit_forest(X[control_mask], effect_control), propensity * slots[v]),
+                    (
+                        self._fit_forest(X[treated_mask], effect_treated),
+                        (1 - propensity) * slots[v],
+                    ),
+                ]
+
+        self.estimators = [tree for forest, _ in forests for tree in forest.estimators_]
+        self.weights = np.concatenate(
+            [
+                np.tile(weight / len(forest.estimators_), (len(forest.estimators_), 1))
+                for forest, weight in forests
+            ]
+        )
+        return self
+
+    def artifact_key(self, data: pd.DataFrame) -> str:
+        """Hash of everything the fitted recommender depends on: training data, parameters and
+        library versions."""
+        digest = hashlib.sha256()
+        digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+        digest.update(
+            json.dumps(
+                {
+                    "artifact_version": ARTIFACT_VERSION,
+                    "sklearn_version": sklearn.__version__,
+                    "columns": [[c, str(t)] for c, t in data.dtypes.items()],
+                    "features": self.features,
+                    "ordinal_features": self.ordinal_features,
+                    "hyperparameters": self.hyperparameters,
+                    "learner": self.learner,
+                    "outcomes": self.outcomes,
+                    "group": self.group,
+                    "control": self.control,
+                },
+                sort_keys=True,
+                default=str,
+            ).encode()
+        )
+        return digest.hexdigest()[:16]
+
+    @staticmethod
+    def artifact_path(directory: str | Path, key: str) -> Path:
+        return Path(directory) / f"uplift-{key}.joblib"
+
+    def save(self, path: str | Path, key: Optional[str] = None) -> Path:
+        """Serialize the fitted recommender."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        artifact = {
+            "artifact_version": ARTIFACT_VERSION,
+            "sklearn_version": sklearn.__version__,
+            "key": key,
+            "recommender": self,
+        }
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        joblib.dump(artifact, tmp_path)
+        tmp_path.replace(path)
+        return path
+
+    @classmethod
+    def load(cls, path: str | Path) -> UpliftRecommender:
+        """Load an artifact written by `save`.
+
+        Raises ValueError if the artifact was written by another artifact format or
+        scikit-learn version.
+        """
+        artifact = joblib.load(path)
+        if (
+            artifact.get("artifact_version") != ARTIFACT_VERSION
+            or artifact.get("sklearn_version") != sklearn.__version__
+        ):
+            raise ValueError(f"Incompatible uplift artifact: {path}")
+        return artifact["recommender"]
+
+    @profiled
+    def fit_or_load(self, data: pd.DataFrame, directory: str | Path) -> UpliftRecommender:
+        """Load the artifact matching `data` and the parameters, or fit and save it.
+
+        Unreadable or incompatible artifacts are refit and overwritten. `max_engagement_loss`
+        only applies when recommending, so it is taken from this instance either way.
+        """
+        key = self.artifact_key(data)
+        path = self.artifact_path(directory, key)
+        if path.exists():
+            try:
+                loaded = self.load(path)
+            except Exception:
+                pass
+            else:
+                max_engagement_loss = self.max_engagement_loss
+                self.__dict__.update(loaded.__dict__)
+                self.max_engagement_loss = max_engagement_loss
+                return self
+
+        self.fit(data)
+        self.save(path, key=key)
+        return self
+
+    def _fit_forest(self, X: np.ndarray, Y: np.ndarray) -> RandomForestRegressor:
+        return RandomForestRegressor(**self.hyperparameters).fit(X, Y)
+
+    @profiled
+    def score(self, payload: Payload) -> np.ndarray:
+        """Expected outcomes of every row under every variant, of shape
+        (rows, variants, outcomes), with variants in the order of `variants` (the control first)
+        and outcomes in the order of `outcomes` (revenue, engagement)."""
+        X = self.encoder.encode(payload)
+        scores = np.zeros((X.shape[0], len(self.variants), len(self.outcomes)))
+        for estimator, weight in zip(self.estimators, self.weights):
+            prediction = estimator.predict(X, check_input=False).reshape(X.shape[0], -1)
+            scores += weight[:, None] * prediction[:, None, :]
+        return scores * self.scale
+
+    def choose(self, scores: np.ndarray, max_engagement_loss: Optional[float] = None) -> np.ndarray:
+        """Position in `variants` of the recommended variant of every row of `scores`."""
+        if max_engagement_loss is None:
+            max_engagement_loss = self.max_engagement_loss
+        revenue, engagement = scores[:, :, 0], scores[:, :, 1]
+        baseline = engagement[:, :1]
+        allowed = engagement >= baseline - max_engagement_loss * np.abs(baseline)
+        # the control is always allowed, and kept on ties
+        return np.where(allowed, revenue, -np.inf).argmax(axis=1)
+
+    @profiled
+    def recommend(self, payload: Payload, max_engagement_loss: Optional[float] = None):
+        """Recommended variant of every row of a DataFrame, a list of dicts or an encoded array."""
+        return self.variants[self.choose(self.score(payload), max_engagement_loss)]
+
+    def explain(
+        self, payload: Payload, max_engagement_loss: Optional[float] = None
+    ) -> pd.DataFrame:
+        """Expected revenue and engagement of every row under every variant, e.g. `n14_A`, and
+        the recommended `variant`."""
+        scores = self.score(payload)
+        columns = [f"{o}_{v}" for o in self.outcomes for v in self.variants]
+        frame = pd.DataFrame(scores.transpose(0, 2, 1).reshape(len(scores), -1), columns=columns)
+        frame[self.group] = self.variants[self.choose(scores, max_engagement_loss)]
+        return frame
@@ -0,0 +1,13 @@
+import pandas as pd
+import pytest
+
+from hotmodel import synthetic
+
+CATEGORICAL_FEATURES = ["c1", "c2", "c3", "c4", "c6", "variant"]
+
+
+@pytest.fixture(scope="session")
+def experiment() -> pd.DataFrame:
+    """Small synthetic experiment, typed as `DatasetLoader` loads it (missing values are NaN)."""
+    data = synthetic.generate(5_000, seed=1)
+    return data.astype({c: "category" for c in CATEGORICAL_FEATURES})
@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+
+from hotmodel import data_loader, synthetic
+from hotmodel.data_loader import DatasetLoader
+
+SCHEMA = {
+    "numerical_columns": [f"n{i}" for i in range(1, 15)],
+    "categorical_columns": ["c1", "c2", "c3", "c4", "c6", "variant"],
+    "boolean_columns": ["c5"],
+}
+
+
+@pytest.fixture(scope="module")
+def csv_path(tmp_path_factory):
+    path = synthetic.write_csv(tmp_path_factory.mktemp("data") / "data.csv", 5_000, seed=3)
+    return str(path)
+
+
+def _parsed_after_load(path) -> pd.DataFrame:
+    """The original loading: untyped `read_csv`, then `parse_column_types`."""
+    loader = DatasetLoader(path=path)
+    loader.data = pd.read_csv(path)
+    loader.parse_column_types(**SCHEMA)
+    return loader.data
+
+
+@pytest.mark.parametrize("engine", ["c", "pyarrow"])
+def test_typed_load_matches_parse_column_types(csv_path, monkeypatch, engine):
+    if engine == "pyarrow":
+        pytest.importorskip("pyarrow")
+    monkeypatch.setattr(data_loader, "CSV_ENGINE", engine)
+    result = DatasetLoader(path=csv_path).load_data(**SCHEMA)
+    expected = _parsed_after_load(csv_path)
+
+    assert list(result.columns) == list(expected.columns)
+    for c in SCHEMA["categorical_columns"]:
+        assert isinstance(result[c].dtype, pd.CategoricalDtype)
+    # categories instead of strings, same values
+    categorical = {c: "string" for c in SCHEMA["categorical_columns"]}
+    pd.testing.assert_frame_equal(
+        result.drop(columns="c5").astype(categorical), expected.drop(columns="c5")
+    )
+
+    # the documented change: missing booleans stay missing instead of becoming True
+    raw = pd.read_csv(csv_path, usecols=["c5"])["c5"]
+    assert result["c5"].dtype == "boolean"
+    pd.testing.assert_series_equal(result["c5"].isna(), raw.isna())
+    present = raw.notna()
+    assert (result["c5"][present] == expected["c5"][present]).all()
+
+
+def test_load_reads_only_the_schema_columns(csv_path):
+    result = DatasetLoader(path=csv_path).load_data(
+        numerical_columns=["n14", "n1"], categorical_columns=["variant"]
+    )
+    # in the order of the file, not of the schema
+    assert list(result.columns) == ["variant", "n1", "n14"]
+
+
+def test_chunks_match_load(csv_path, monkeypatch):
+    monkeypatch.setattr(data_loader, "CSV_ENGINE", "c")
+    loader = DatasetLoader(path=csv_path)
+    chunks = pd.concat(list(loader.iter_chunks(chunksize=1_234, **SCHEMA)), ignore_index=True)
+    expected = DatasetLoader(path=csv_path).load_data(**SCHEMA)
+    # the categories of every chunk are the values it holds
+    categorical = {c: object for c in SCHEMA["categorical_columns"]}
+    pd.testing.assert_frame_equal(chunks.astype(categorical), expected.astype(categorical))
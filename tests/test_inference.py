@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from hotmodel.model import HotModelClassifier
+
+# fmt: off
+FEATURES = [
+    "c1", "c2", "c3", "c4", "c6",
+    "n1", "n2", "n3", "n4", "n5", "n6", "n7", "n8", "n10", "n11", "n12", "n14",
+]
+# fmt: on
+ORDINAL_FEATURES = ["c1", "c2", "c3", "c4", "c6"]
+HYPERPARAMETERS = {"n_estimators": 10, "min_samples_leaf": 20, "random_state": 0}
+
+
+@pytest.fixture(scope="module")
+def model(experiment: pd.DataFrame) -> HotModelClassifier:
+    model = HotModelClassifier(
+        data=experiment.copy(), features=FEATURES, hyperparameters=HYPERPARAMETERS
+    )
+    transformed = model.pipeline_builder(ordinal_features=ORDINAL_FEATURES, one_hot_features=None)
+    model.train(transformed, target="target")
+    assert model.predictor is not None
+    return model
+
+
+@pytest.fixture(scope="module")
+def payload(experiment: pd.DataFrame) -> pd.DataFrame:
+    return experiment.iloc[:500][FEATURES].astype({c: object for c in ORDINAL_FEATURES})
+
+
+def _pipeline_proba(model: HotModelClassifier, payload: pd.DataFrame) -> np.ndarray:
+    return model.model.predict_proba(model._model_input(payload))
+
+
+def test_compiled_predictor_matches_pipeline(model, payload):
+    expected = _pipeline_proba(model, payload)
+    np.testing.assert_allclose(model.predictor.predict_proba(payload), expected)
+
+
+def test_compiled_predictor_matches_pipeline_on_dict_rows(model, payload):
+    rows = payload.to_dict(orient="records")
+    expected = _pipeline_proba(model, payload)
+    np.testing.assert_allclose(model.predictor.predict_proba(rows), expected)
+
+
+def test_compiled_predict_matches_pipeline(model, payload):
+    expected = model.label_encoder.inverse_transform(
+        model.model.predict(model._model_input(payload))
+    )
+    np.testing.assert_array_equal(model.predict(payload), expected)
+
+
+def test_compiled_predictor_rejects_missing_features(model, payload):
+    with pytest.raises(ValueError, match="Missing features"):
+        model.predictor.predict_proba(payload.drop(columns=["n3"]))
+    rows = payload.iloc[:2].to_dict(orient="records")
+    del rows[1]["c2"]
+    with pytest.raises(ValueError, match="Missing features"):
+        model.predictor.predict_proba(rows)
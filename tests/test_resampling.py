@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+from hotmodel.resampling import drop_na_in_group, random_undersample
+
+
+def _baseline_drop_na_in_group(data: pd.DataFrame, col: str, group: str) -> pd.DataFrame:
+    """The original implementation, with index lookups."""
+    temp_a = data[data[col] == group].dropna(axis=0, how="any")
+    temp_b = data[data[col] != group]
+    return data.loc[list(temp_a.index) + list(temp_b.index), :]
+
+
+def test_drop_na_in_group_matches_baseline(experiment):
+    result = drop_na_in_group(experiment, col="variant", group="A")
+    pd.testing.assert_frame_equal(
+        result, _baseline_drop_na_in_group(experiment, col="variant", group="A")
+    )
+
+
+def test_drop_na_in_group_keeps_rows_without_group_out_of_it(experiment):
+    data = experiment.copy()
+    data.loc[data.index[:10], "variant"] = np.nan
+    result = drop_na_in_group(data, col="variant", group="A")
+    assert data.index[:10].isin(result.index).all()
+    assert not result[result["variant"] == "A"].isna().any().any()
+
+
+def test_random_undersample_balances_groups(experiment):
+    data = experiment.copy()
+    data.loc[data.index[:10], "variant"] = np.nan
+    result = random_undersample(data, col="variant", seed=0)
+    counts = result["variant"].value_counts()
+    assert counts["A"] == counts["B"] == (data["variant"] == "B").sum()
+    assert result["variant"].notna().all()
+    assert result.index.is_monotonic_increasing
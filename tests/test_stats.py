@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+
+from hotmodel import stats
+
+COLUMNS = ["c1", "c2", "c3", "c4", "c6"]
+
+
+def _groupby_substats(data: pd.DataFrame, col: list[str]) -> dict[str, pd.DataFrame]:
+    """The original implementation, one groupby per column."""
+    result = {}
+    for c in col:
+        a = stats.get_stats_by_variant(data, col=[c])
+        b = a.groupby(["variant"], observed=True).agg({"count": "sum"})
+        result[c] = {"primary": a, "secondary": b}
+    return result
+
+
+def _chunks(data: pd.DataFrame, size: int):
+    return (data.iloc[i : i + size] for i in range(0, data.shape[0], size))
+
+
+@pytest.mark.parametrize("typed", [True, False])
+def test_bincount_substats_match_groupby(experiment, typed):
+    data = experiment if typed else experiment.astype({c: object for c in COLUMNS + ["variant"]})
+    result = stats.get_categorical_substats_by_variant_and_column(data, COLUMNS)
+    expected = _groupby_substats(data, COLUMNS)
+    for c in COLUMNS:
+        pd.testing.assert_frame_equal(result[c]["primary"], expected[c]["primary"])
+        pd.testing.assert_frame_equal(result[c]["secondary"], expected[c]["secondary"])
+
+
+def test_streaming_stats_match_in_memory(experiment):
+    streaming = stats.StreamingStats([["c1", "c2"]] + [[c] for c in COLUMNS])
+    streaming.update_from_chunks(_chunks(experiment, 1_234))
+
+    pd.testing.assert_frame_equal(
+        streaming.get_stats_by_variant(["c1", "c2"]),
+        stats.get_stats_by_variant(experiment, ["c1", "c2"]),
+    )
+    result = streaming.get_categorical_substats_by_variant_and_column(COLUMNS)
+    expected = stats.get_categorical_substats_by_variant_and_column(experiment, COLUMNS)
+    for c in COLUMNS:
+        pd.testing.assert_frame_equal(result[c]["primary"], expected[c]["primary"])
+        pd.testing.assert_frame_equal(result[c]["secondary"], expected[c]["secondary"])
+    pd.testing.assert_frame_equal(
+        streaming.get_percentage_missing_values(),
+        stats.get_percentage_missing_values(experiment),
+    )
+
+
+def test_merged_streaming_stats_match_in_memory(experiment):
+    halves = [experiment.iloc[:2_000], experiment.iloc[2_000:]]
+    merged = stats.StreamingStats([["c1"]]).update(halves[0])
+    merged.merge(stats.StreamingStats([["c1"]]).update(halves[1]))
+    pd.testing.assert_frame_equal(
+        merged.get_stats_by_variant(["c1"]), stats.get_stats_by_variant(experiment, ["c1"])
+    )
@@ -0,0 +1,30 @@
+import pytest
+
+from hotmodel.tuning import HyperparameterSearch
+
+SEARCH_SPACE = {
+    "features": ["c1", "c2", "n1", "n2", "n3"],
+    "ordinal_features": ["c1", "c2"],
+    "target": "variant",
+    "resource": "n_estimators",
+    "min_resource": 5,
+    "max_resource": 45,
+    "eta": 3,
+    "seed": 0,
+    "space": {"max_depth": [3, 5, 10], "min_samples_leaf": [20, 100]},
+}
+
+
+@pytest.mark.parametrize(
+    "strategy, n_candidates",
+    [("successive_halving", 3), ("successive_halving", 1), ("hyperband", None)],
+)
+def test_search_gives_the_whole_budget_to_the_best(experiment, strategy, n_candidates):
+    search_space = {**SEARCH_SPACE, "strategy": strategy, "n_candidates": n_candidates}
+    search = HyperparameterSearch(experiment.copy(), search_space, n_jobs=1)
+    history = search.run()
+
+    assert search.best_params_["n_estimators"] == 45
+    # every bracket ends with its survivor trained with the whole budget
+    last = history.groupby("bracket")["n_estimators"].max()
+    assert (last == 45).all()